@@ -0,0 +1,425 @@
+"""
+Computation layer behind the dashboard sections.
+
+Every function here takes a query backend plus plain parameters and returns
+DataFrames or counts, without touching Streamlit. The sections don't depend
+on each other, so `app.py` can compute them side by side on a thread pool and
+render the results in page order.
+"""
+from collections import namedtuple
+from dataclasses import replace
+from datetime import timedelta
+
+import pandas as pd
+
+from backend import DAY, WEEK_START, CaseFilter, day_ordinal
+from sketch import DayHistogram
+
+KEY_PRODUCT_LINES = ['Barcode', 'RFID', 'PRI', 'Reach']
+EXCLUDED_TYPE = "RMA request"
+BACKLOG_OWNERS = ['Akhila Kotha', 'Manasa Lakshmi', 'Surendra Moilla']
+RESOLUTION_CLOSED_STATUSES = ['Closed - Complete']
+COMPARISON_PRESETS = ('This week vs. last week', 'Last 4 weeks vs. the 4 before',
+                      'Quarter to date vs. same period last year', 'Custom')
+# Open case age percentiles added next to the mean age
+AGE_PERCENTILES = {'Median Age (Days)': 0.5, 'P90 Age (Days)': 0.9}
+# Measures of the weekly cube behind the comparison view
+OPENED = 'Opened'
+CLOSED = 'Closed'
+OPENED_OWNERS = 'Opened (Owners)'
+NOW_CLOSED_OWNERS = 'Now Closed (Owners)'
+
+# `product_line` and `owner` optionally narrow every section to one product line/owner
+Settings = namedtuple('Settings', ['open_statuses', 'closed_statuses', 'open_statuses_avg', 'owners',
+                                   'product_line', 'owner'], defaults=[None, None])
+
+
+def _narrow(values, only):
+    if only is None:
+        return values
+    if values is None:
+        return (only,)
+    return tuple(v for v in values if v == only)
+
+
+def scoped_filter(settings, **conditions):
+    """Builds a CaseFilter and narrows it to the settings' product line and owner, if any."""
+    flt = CaseFilter(**conditions)
+    return replace(flt, product_lines=_narrow(flt.product_lines, settings.product_line),
+                   owners=_narrow(flt.owners, settings.owner))
+
+
+def with_grand_total(summary_df):
+    """Appends the bold Grand Total row used under the by-reason tables."""
+    total_row = pd.DataFrame([{'Product Line': '**Grand Total**', 'Case Reason': '',
+                               'Record Count': summary_df['Record Count'].sum()}])
+    return pd.concat([summary_df, total_row], ignore_index=True)
+
+
+def week_label(week_start):
+    week_end = week_start + timedelta(days=6)
+    iso = week_start.isocalendar()
+    return f"Week {iso.week} FY {iso.year} ({week_start.strftime('%m/%d/%Y')} – {week_end.strftime('%m/%d/%Y')})"
+
+
+# --- SELECTED PERIOD ---
+def weekly_overview(backend, start_date, end_date, settings):
+    """Cases opened and closed in each Monday-based week of the range."""
+    week_starts = pd.date_range(start=start_date, end=end_date, freq='W-MON')
+    week_windows = [(week_start, week_start + timedelta(days=6)) for week_start in week_starts]
+    opened_counts = backend.window_counts(scoped_filter(settings, statuses=tuple(settings.open_statuses)), 'Opened Date', week_windows)
+    closed_counts = [0] * len(week_windows)
+    if 'Case Last Modified Date' in backend.columns:
+        closed_counts = backend.window_counts(scoped_filter(settings, statuses=tuple(settings.closed_statuses)), 'Case Last Modified Date', week_windows)
+
+    opened_summary_data = []
+    closed_summary_data = []
+    for (week_start, _), opened_count, closed_count in zip(week_windows, opened_counts, closed_counts):
+        week_str = week_label(week_start)
+        opened_summary_data.append({'Week': week_str, 'Cases Opened': opened_count})
+        closed_summary_data.append({'Week': week_str, 'Cases Closed': closed_count})
+
+    return pd.DataFrame(opened_summary_data), pd.DataFrame(closed_summary_data)
+
+
+def _period_filters(start_dt, end_dt, settings):
+    owners = tuple(settings.owners)
+    in_range_filter = scoped_filter(settings, opened_from=start_dt, opened_to=end_dt,
+                                    statuses=tuple(settings.open_statuses), owners=owners)
+    # Of the cases opened in range (already restricted to open statuses), those now closed
+    closed_in_range_filter = scoped_filter(settings, opened_from=start_dt, opened_to=end_dt,
+                                           statuses=tuple(s for s in settings.open_statuses if s in settings.closed_statuses),
+                                           owners=owners)
+    closed_in_period_filter = scoped_filter(settings, modified_from=start_dt, modified_to=end_dt,
+                                            statuses=tuple(settings.closed_statuses))
+    return in_range_filter, closed_in_range_filter, closed_in_period_filter
+
+
+def period_metrics(backend, start_dt, end_dt, settings):
+    """The three metric cards of the selected period, as counts only."""
+    in_range_filter, closed_in_range_filter, closed_in_period_filter = _period_filters(start_dt, end_dt, settings)
+    closed_in_period = 0
+    if 'Case Last Modified Date' in backend.columns:
+        closed_in_period = backend.count(closed_in_period_filter)
+    return {
+        'Total Open Cases': backend.count(in_range_filter),
+        'Of Those, Now Closed': backend.count(closed_in_range_filter),
+        'Total Cases Closed in Period': closed_in_period,
+    }
+
+
+def period_breakdowns(backend, start_dt, end_dt, settings):
+    """Detailed rows and product line/reason splits for the selected period."""
+    in_range_filter, closed_in_range_filter, closed_in_period_filter = _period_filters(start_dt, end_dt, settings)
+
+    result = {
+        'cases_in_range': backend.rows(in_range_filter),
+        'closed_cases_data': backend.rows(closed_in_range_filter),
+        'closed_in_period': pd.DataFrame(),
+    }
+    result['all_by_product'] = backend.group_counts(in_range_filter, 'Product Line', 'Record Count')
+    result['closed_by_product'] = backend.group_counts(closed_in_range_filter, 'Product Line', 'Record Count')
+    if 'Case Reason' in backend.columns:
+        result['all_by_reason'] = backend.group_counts(in_range_filter, ['Product Line', 'Case Reason'], 'Record Count')
+        result['closed_by_reason'] = backend.group_counts(closed_in_range_filter, ['Product Line', 'Case Reason'], 'Record Count')
+
+    if 'Case Last Modified Date' in backend.columns:
+        result['closed_in_period'] = backend.rows(closed_in_period_filter)
+        result['closed_in_period_by_product'] = backend.group_counts(closed_in_period_filter, 'Product Line', 'Record Count')
+        if 'Case Reason' in backend.columns:
+            result['closed_in_period_by_reason'] = backend.group_counts(
+                closed_in_period_filter, ['Product Line', 'Case Reason'], 'Record Count')
+    return result
+
+
+# --- PERIOD COMPARISON ---
+def snap_to_weeks(start, end):
+    """Widens a date range to the Monday starting its first week and the Sunday ending its last."""
+    start = pd.Timestamp(start).normalize()
+    end = pd.Timestamp(end).normalize()
+    return start - timedelta(days=start.weekday()), end + timedelta(days=6 - end.weekday())
+
+
+def preset_periods(preset, anchor):
+    """The (current, baseline) date ranges of a comparison preset ending in `anchor`'s week."""
+    anchor = pd.Timestamp(anchor).normalize()
+    if preset == 'This week vs. last week':
+        current = snap_to_weeks(anchor, anchor)
+        return current, (current[0] - timedelta(weeks=1), current[1] - timedelta(weeks=1))
+    if preset == 'Last 4 weeks vs. the 4 before':
+        current = snap_to_weeks(anchor - timedelta(weeks=3), anchor)
+        return current, (current[0] - timedelta(weeks=4), current[1] - timedelta(weeks=4))
+    if preset == 'Quarter to date vs. same period last year':
+        quarter_start = anchor.to_period('Q').start_time
+        year = pd.DateOffset(years=1)
+        return snap_to_weeks(quarter_start, anchor), snap_to_weeks(quarter_start - year, anchor - year)
+    raise ValueError(f"Unknown comparison preset: {preset}")
+
+
+def weekly_cube(backend, settings):
+    """Case counts per Monday-based week and product line over the whole export.
+
+    Any range of whole weeks can be answered by summing its rows, so both
+    sides of a comparison come from one pass over the data.
+    """
+    owners = tuple(settings.owners)
+    measures = {
+        OPENED: (scoped_filter(settings, statuses=tuple(settings.open_statuses)), 'Opened Date'),
+        OPENED_OWNERS: (scoped_filter(settings, statuses=tuple(settings.open_statuses), owners=owners), 'Opened Date'),
+        NOW_CLOSED_OWNERS: (scoped_filter(settings, statuses=tuple(s for s in settings.open_statuses if s in settings.closed_statuses),
+                                          owners=owners), 'Opened Date'),
+    }
+    if 'Case Last Modified Date' in backend.columns:
+        measures[CLOSED] = (scoped_filter(settings, statuses=tuple(settings.closed_statuses)), 'Case Last Modified Date')
+
+    counts = []
+    for measure, (flt, column) in measures.items():
+        frame = backend.weekly_group_counts(flt, column, 'Product Line', measure)
+        frame['Product Line'] = frame['Product Line'].astype(object)
+        counts.append(frame.set_index([WEEK_START, 'Product Line'])[measure])
+    cube = pd.concat(counts, axis=1).reindex(columns=[OPENED, CLOSED, OPENED_OWNERS, NOW_CLOSED_OWNERS])
+    return cube.fillna(0).astype('int64').reset_index()
+
+
+def cube_period(cube, start, end):
+    """Weekly rows, metric counts and product line totals of the whole weeks in [start, end]."""
+    start, end = snap_to_weeks(start, end)
+    rows = cube[(cube[WEEK_START] >= start) & (cube[WEEK_START] <= end)]
+    measures = [OPENED, CLOSED, OPENED_OWNERS, NOW_CLOSED_OWNERS]
+    weekly = rows.groupby(WEEK_START)[measures].sum().reindex(
+        pd.date_range(start, end, freq='W-MON'), fill_value=0)
+    return {
+        'start': start,
+        'end': end,
+        'weekly': weekly,
+        'metrics': {
+            'Total Open Cases': int(rows[OPENED_OWNERS].sum()),
+            'Of Those, Now Closed': int(rows[NOW_CLOSED_OWNERS].sum()),
+            'Total Cases Closed in Period': int(rows[CLOSED].sum()),
+        },
+        'by_product': rows.dropna(subset=['Product Line']).groupby('Product Line')[measures].sum(),
+    }
+
+
+def compare_periods(cube, current, baseline):
+    """Side-by-side tables of two periods, each given as a (start, end) pair."""
+    now = cube_period(cube, *current)
+    before = cube_period(cube, *baseline)
+
+    metrics = {label: (value, value - before['metrics'][label]) for label, value in now['metrics'].items()}
+
+    # weeks are paired by position: the first week of one period against the first of the other
+    def weekly_table(period, suffix):
+        weekly = period['weekly']
+        return pd.DataFrame({
+            f'Week ({suffix})': [week_label(week_start) for week_start in weekly.index],
+            f'Opened ({suffix})': weekly[OPENED].values,
+            f'Closed ({suffix})': weekly[CLOSED].values,
+        })
+    weekly = pd.concat([weekly_table(now, 'Current'), weekly_table(before, 'Baseline')], axis=1)
+    counts = [column for column in weekly.columns if not column.startswith('Week')]
+    # periods of different lengths leave blanks that would otherwise turn the counts into floats
+    weekly[counts] = weekly[counts].astype('Int64')
+    weekly['Opened Change'] = weekly['Opened (Current)'] - weekly['Opened (Baseline)']
+    weekly['Closed Change'] = weekly['Closed (Current)'] - weekly['Closed (Baseline)']
+
+    by_product = pd.DataFrame({
+        'Opened (Current)': now['by_product'][OPENED_OWNERS],
+        'Opened (Baseline)': before['by_product'][OPENED_OWNERS],
+        'Closed (Current)': now['by_product'][CLOSED],
+        'Closed (Baseline)': before['by_product'][CLOSED],
+    }).fillna(0).astype('int64')
+    by_product['Opened Change'] = by_product['Opened (Current)'] - by_product['Opened (Baseline)']
+    by_product['Closed Change'] = by_product['Closed (Current)'] - by_product['Closed (Baseline)']
+    by_product = by_product.rename_axis('Product Line').reset_index()
+
+    return {
+        'current': (now['start'], now['end']),
+        'baseline': (before['start'], before['end']),
+        'metrics': metrics,
+        'weekly': weekly,
+        'by_product': by_product,
+    }
+
+
+# --- YEAR TO DATE ---
+def product_drilldown(backend, product, start_of_year, today, settings):
+    """Open YTD cases of one key product line, split by model, reason and owner."""
+    product_filter = scoped_filter(
+        settings,
+        opened_from=pd.to_datetime(start_of_year),
+        opened_to=pd.to_datetime(today),
+        statuses=tuple(settings.open_statuses),
+        product_lines=(product,),
+        exclude_type=EXCLUDED_TYPE,
+        owners=tuple(settings.owners),
+    )
+    result = {'count': backend.count(product_filter)}
+    if result['count'] > 0:
+        for key, column in (('by_model', 'Product Model'), ('by_reason', 'Case Reason'), ('by_owner', 'Case Owner')):
+            if column in backend.columns:
+                result[key] = backend.group_counts(product_filter, column)
+    return result
+
+
+def ytd_backlog(backend, start_of_year, today, settings):
+    """Open YTD cases assigned to the backlog owners, with their pie chart splits."""
+    ytd_backlog_filter = scoped_filter(
+        settings,
+        opened_from=pd.to_datetime(start_of_year),
+        opened_to=pd.to_datetime(today),
+        statuses=tuple(settings.open_statuses),
+        owners=tuple(BACKLOG_OWNERS),
+    )
+    result = {'rows': backend.rows(ytd_backlog_filter)}
+    if not result['rows'].empty:
+        for key, column in (('by_product', 'Product Line'), ('by_model', 'Product Model'),
+                            ('by_reason', 'Case Reason'), ('by_owner', 'Case Owner')):
+            if column in backend.columns:
+                result[key] = backend.group_counts(ytd_backlog_filter, column)
+    return result
+
+
+def average_age_trend(backend, start_of_year, today, settings):
+    """Weekly mean of the daily average open case age for the key product lines.
+
+    Returns None when no case matches at all, an empty frame when cases match
+    but none was open yet in the period.
+    """
+    all_open_ytd_filter = scoped_filter(
+        settings,
+        statuses=tuple(settings.open_statuses_avg),
+        product_lines=tuple(KEY_PRODUCT_LINES),
+        owners=tuple(settings.owners),
+        exclude_type=EXCLUDED_TYPE,
+    )
+    if backend.count(all_open_ytd_filter) == 0:
+        return None
+
+    daily_avg_age = backend.mean_age(all_open_ytd_filter, pd.date_range(start=start_of_year, end=today))
+    if daily_avg_age.empty:
+        return pd.DataFrame()
+    trend_df = daily_avg_age.rename_axis('Date').to_frame('Average Age (Days)')
+    weekly_trend_df = trend_df.resample('W-Mon').mean().reset_index()
+    weekly_trend_df['Week Number'] = weekly_trend_df.index
+    return weekly_trend_df
+
+
+def resolution_trend(backend, start_of_year, today, settings):
+    """Weekly average of open case age and resolution time since the start of the year.
+
+    Returns None when no case matches at all.
+    """
+    closed_statuses = RESOLUTION_CLOSED_STATUSES
+    relevant_filter = scoped_filter(
+        settings,
+        statuses=tuple(settings.open_statuses_avg + closed_statuses),
+        opened_from=pd.to_datetime(start_of_year),
+        exclude_type=EXCLUDED_TYPE,
+    )
+    if backend.count(relevant_filter) == 0:
+        return None
+
+    week_starts = pd.date_range(start=start_of_year, end=today, freq='W-MON')
+    # --- OPEN CASES: calculate how long they've been open so far ---
+    open_ages = backend.mean_age(
+        scoped_filter(settings, statuses=tuple(settings.open_statuses_avg), opened_from=pd.to_datetime(start_of_year), exclude_type=EXCLUDED_TYPE),
+        week_starts,
+    )
+    # --- CLOSED CASES: calculate resolution time ---
+    closed_times = backend.mean_resolution(
+        scoped_filter(settings, statuses=tuple(closed_statuses), opened_from=pd.to_datetime(start_of_year), exclude_type=EXCLUDED_TYPE),
+        week_starts,
+    )
+
+    weekly_avg_data = []
+    for week_start in week_starts:
+        # Combine both into a single average if any data exists
+        valid_averages = [v for v in [open_ages.get(week_start), closed_times.get(week_start)] if v is not None]
+        if valid_averages:
+            weekly_avg_data.append({
+                'Week Start': week_start,
+                'Average Time (Days)': sum(valid_averages) / len(valid_averages)
+            })
+
+    weekly_trend_df = pd.DataFrame(weekly_avg_data)
+    if not weekly_trend_df.empty:
+        weekly_trend_df['Week Number'] = range(1, len(weekly_trend_df) + 1)
+    return weekly_trend_df
+
+
+def aging_sketches(backend, settings):
+    """Opening-day histograms of the open, non-RMA cases, one per (product line, owner).
+
+    Built in a single grouped query; `age_percentiles` merges whichever of
+    them a chart needs.
+    """
+    open_filter = scoped_filter(
+        settings,
+        statuses=tuple(settings.open_statuses_avg),
+        owners=tuple(settings.owners),
+        exclude_type=EXCLUDED_TYPE,
+    )
+    counts = backend.day_counts(open_filter, 'Opened Date', ['Product Line', 'Case Owner'])
+    return {key: DayHistogram(group[DAY], group['Count'])
+            for key, group in counts.groupby(['Product Line', 'Case Owner'], observed=True, dropna=False)}
+
+
+def age_percentiles(sketches, points, product_lines=None, owners=None):
+    """Median and 90th percentile age in days of the cases opened on or before each point's day.
+
+    Points without any such case are left out, as in `mean_age`.
+    """
+    merged = DayHistogram()
+    for (product, owner), histogram in sketches.items():
+        if (product_lines is None or product in product_lines) and (owners is None or owner in owners):
+            merged = merged + histogram
+
+    rows = []
+    for point in points:
+        day = day_ordinal(point)
+        if merged.count_upto(day):
+            # the oldest cases have the earliest opening days, so age quantile q is opening quantile 1 - q
+            rows.append({WEEK_START: point, **{label: day - merged.quantile(1 - q, upto=day)
+                                               for label, q in AGE_PERCENTILES.items()}})
+    return pd.DataFrame(rows, columns=[WEEK_START, *AGE_PERCENTILES])
+
+
+def owner_age_percentiles(sketches, owners, start_of_year, today):
+    """Weekly median and p90 open case age of each owner across all product lines."""
+    week_starts = pd.date_range(start=start_of_year, end=today, freq='W-MON')
+    frames = []
+    for owner in owners:
+        owner_df = age_percentiles(sketches, week_starts, owners=(owner,))
+        if not owner_df.empty:
+            owner_df.insert(1, 'Case Owner', owner)
+            owner_df['Week Number'] = range(1, len(owner_df) + 1)
+            frames.append(owner_df)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def product_age_trend(backend, product, start_of_year, today, settings, sketches=None):
+    """Weekly average open case age for one product line, excluding RMA requests.
+
+    With `sketches` from `aging_sketches`, the weekly median and p90 age
+    are added next to the mean. Returns None when the product has no
+    matching cases.
+    """
+    product_open_filter = scoped_filter(
+        settings,
+        statuses=tuple(settings.open_statuses_avg),
+        product_lines=(product,),
+        owners=tuple(settings.owners),
+        exclude_type=EXCLUDED_TYPE,
+    )
+    if backend.count(product_open_filter) == 0:
+        return None
+
+    weekly_ages = backend.mean_age(product_open_filter, pd.date_range(start=start_of_year, end=today, freq='W-MON'))
+    weekly_trend_df_product = pd.DataFrame({'Week Start': weekly_ages.index, 'Average Age (Days)': weekly_ages.values})
+    if sketches is not None:
+        percentiles = age_percentiles(sketches, weekly_ages.index, product_lines=(product,))
+        weekly_trend_df_product = weekly_trend_df_product.merge(percentiles, on=WEEK_START, how='left')
+    if not weekly_trend_df_product.empty:
+        weekly_trend_df_product['Week Number'] = range(1, len(weekly_trend_df_product) + 1)
+    return weekly_trend_df_product
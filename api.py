@@ -0,0 +1,269 @@
+"""
+Local JSON API serving the dashboard's aggregates to other internal tools.
+
+Runs next to the Streamlit app (set API_PORT) or on its own:
+
+    python api.py export.xlsx --port 8502
+    python api.py --watch /shared/crm-exports
+
+Next to the app it serves the WATCH_DIR dataset when a folder is watched.
+Otherwise it serves the upload, but only while a single distinct upload is
+loaded: with several, requests get a 409 rather than answers that flip
+between whichever export a browser session touched last.
+
+Endpoints (GET), all answered from the same computation layer as the page:
+
+    /weekly       cases opened and closed per week
+    /metrics      the metric cards of the period
+    /breakdowns   product line and case reason splits of the period
+    /backlog      YTD open case drill-downs and backlog
+    /aging        YTD average age, resolution time, per-product age trends and
+                  per-owner median/p90 age
+
+Query parameters: `start` and `end` (YYYY-MM-DD, default: the whole export),
+`product_line` and `owner`. /backlog and /aging are year-to-date only: like
+their dashboard sections they always cover January 1st to today and ignore
+`start` and `end`. Responses carry an ETag derived from the dataset hash and
+the query, so a poller sending If-None-Match gets a bodyless 304 until the
+data actually changes.
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+from dotenv import load_dotenv
+
+import aggregates
+from aggregates import KEY_PRODUCT_LINES
+
+CACHE_ENTRIES = 256
+
+
+def _records(frame):
+    if frame is None:
+        return None
+    return json.loads(frame.to_json(orient='records', date_format='iso'))
+
+
+def _period(backend, params):
+    min_opened, max_opened = backend.date_bounds('Opened Date')
+    start = pd.to_datetime(params.get('start') or min_opened.date())
+    end = pd.to_datetime(params.get('end') or max_opened.date())
+    return start, end
+
+
+# --- ENDPOINTS ---
+def weekly(backend, params, settings):
+    start, end = _period(backend, params)
+    opened_df, closed_df = aggregates.weekly_overview(backend, start, end, settings)
+    if not opened_df.empty:
+        opened_df['Cases Closed'] = closed_df['Cases Closed']
+    return {'start': start.date().isoformat(), 'end': end.date().isoformat(), 'weeks': _records(opened_df)}
+
+
+def metrics(backend, params, settings):
+    start, end = _period(backend, params)
+    return {'start': start.date().isoformat(), 'end': end.date().isoformat(),
+            **aggregates.period_metrics(backend, start, end, settings)}
+
+
+def breakdowns(backend, params, settings):
+    start, end = _period(backend, params)
+    period = aggregates.period_breakdowns(backend, start, end, settings)
+    return {'start': start.date().isoformat(), 'end': end.date().isoformat(),
+            **{key: _records(value) for key, value in period.items()
+               if key not in ('cases_in_range', 'closed_cases_data', 'closed_in_period')}}
+
+
+def backlog(backend, params, settings):
+    today = date.today()
+    start_of_year = date(today.year, 1, 1)
+    ytd = aggregates.ytd_backlog(backend, start_of_year, today, settings)
+    drilldowns = {}
+    for product in KEY_PRODUCT_LINES:
+        drilldown = aggregates.product_drilldown(backend, product, start_of_year, today, settings)
+        drilldowns[product] = {key: value if key == 'count' else _records(value) for key, value in drilldown.items()}
+    return {
+        'start': start_of_year.isoformat(), 'end': today.isoformat(),
+        'backlog': {'count': len(ytd['rows']),
+                    **{key: _records(value) for key, value in ytd.items() if key != 'rows'}},
+        'drilldowns': drilldowns,
+    }
+
+
+def aging(backend, params, settings):
+    today = date.today()
+    start_of_year = date(today.year, 1, 1)
+    sketches = aggregates.aging_sketches(backend, settings)
+    product_trends = {product: _records(aggregates.product_age_trend(backend, product, start_of_year, today, settings, sketches))
+                      for product in KEY_PRODUCT_LINES}
+    resolution = None
+    if 'Case Last Modified Date' in backend.columns:
+        resolution = _records(aggregates.resolution_trend(backend, start_of_year, today, settings))
+    return {
+        'start': start_of_year.isoformat(), 'end': today.isoformat(),
+        'average_age': _records(aggregates.average_age_trend(backend, start_of_year, today, settings)),
+        'resolution_time': resolution,
+        'product_age': product_trends,
+        'owner_age_percentiles': _records(aggregates.owner_age_percentiles(
+            sketches, [settings.owner] if settings.owner else settings.owners, start_of_year, today)),
+    }
+
+
+ENDPOINTS = {
+    '/weekly': weekly,
+    '/metrics': metrics,
+    '/breakdowns': breakdowns,
+    '/backlog': backlog,
+    '/aging': aging,
+}
+PARAMETERS = ('start', 'end', 'product_line', 'owner')
+# Year-to-date endpoints; a date range wouldn't change their answer
+YTD_ENDPOINTS = ('/backlog', '/aging')
+
+
+class AggregatesHandler(BaseHTTPRequestHandler):
+    """Answers GET requests from `server.get_dataset()` with cached JSON bodies."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path.rstrip('/') or '/'
+        endpoint = ENDPOINTS.get(path)
+        if endpoint is None:
+            return self._send_json(404, {'error': f"Unknown endpoint, expected one of {', '.join(ENDPOINTS)}"})
+        params = {key: values[-1] for key, values in parse_qs(url.query).items() if key in PARAMETERS
+                  # so every range shares one cached body and ETag
+                  if not (path in YTD_ENDPOINTS and key in ('start', 'end'))}
+        for key in ('start', 'end'):
+            if key in params:
+                try:
+                    date.fromisoformat(params[key])
+                except ValueError:
+                    return self._send_json(400, {'error': f"'{key}' must be a YYYY-MM-DD date"})
+
+        try:
+            dataset = self.server.get_dataset()
+        except LookupError as e:
+            return self._send_json(409, {'error': str(e)})
+        if dataset is None:
+            return self._send_json(503, {'error': 'No dataset has been loaded yet'})
+
+        # YTD answers move with the calendar even when the data doesn't
+        cache_key = (dataset.dataset_id, date.today().isoformat(), path, tuple(sorted(params.items())))
+        etag = '"' + hashlib.sha256(repr(cache_key).encode()).hexdigest()[:32] + '"'
+        if self.headers.get('If-None-Match') == etag:
+            return self._send(304, None, etag)
+
+        body = self.server.cache_get(cache_key)
+        if body is None:
+            settings = self.server.settings._replace(product_line=params.get('product_line'), owner=params.get('owner'))
+            result = endpoint(dataset.backend, params, settings)
+            body = json.dumps({'dataset_id': dataset.dataset_id, **result}).encode()
+            self.server.cache_put(cache_key, body)
+        self._send(200, body, etag)
+
+    def _send_json(self, status, payload):
+        self._send(status, json.dumps(payload).encode())
+
+    def _send(self, status, body, etag=None):
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        if body is not None:
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # pollers hit this every few seconds; keep the app's console readable
+        pass
+
+
+class AggregatesServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, get_dataset, settings):
+        super().__init__(address, AggregatesHandler)
+        self.get_dataset = get_dataset
+        self.settings = settings
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def cache_get(self, key):
+        with self._cache_lock:
+            body = self._cache.get(key)
+            if body is not None:
+                self._cache.move_to_end(key)
+            return body
+
+    def cache_put(self, key, body):
+        with self._cache_lock:
+            self._cache[key] = body
+            while len(self._cache) > CACHE_ENTRIES:
+                self._cache.popitem(last=False)
+
+
+def serve_in_background(get_dataset, settings, host='127.0.0.1', port=8502):
+    """Starts the API on a daemon thread and returns the server."""
+    server = AggregatesServer((host, port), get_dataset, settings)
+    threading.Thread(target=server.serve_forever, name='aggregates-api', daemon=True).start()
+    return server
+
+
+def _status_list(env_key):
+    value = os.getenv(env_key, "")
+    return [status.strip() for status in value.split(",") if status.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the case dashboard's aggregates as JSON.")
+    parser.add_argument('export', nargs='?', help='case export (.xlsx) to serve')
+    parser.add_argument('--watch', help='directory of exports to watch instead of a single file')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=int(os.getenv('API_PORT') or 8502))
+    args = parser.parse_args()
+    if not args.export and not args.watch:
+        parser.error('give an export file or --watch DIR')
+
+    load_dotenv()
+    settings = aggregates.Settings(_status_list('OPEN_STATUSES'), _status_list('CLOSED_STATUSES'),
+                                   _status_list('OPEN_STATUSES_AVG'), _status_list('SELECTED_OWNERS'))
+    engine = os.getenv('CASE_BACKEND', 'pandas').strip().lower()
+    db_dir = os.getenv('CASE_DB_DIR', '').strip() or None
+    report_columns = None if os.getenv('REPORT_COLUMNS', '').strip() == '*' else (
+        _status_list('REPORT_COLUMNS') or ['Case Number', 'Subject'])
+
+    if args.watch:
+        from watcher import FolderWatcher
+        watcher = FolderWatcher(args.watch, engine, db_dir, report_columns,
+                                int(os.getenv('WATCH_INTERVAL_SECONDS', '30'))).start()
+        get_dataset = lambda: watcher.dataset
+    else:
+        from ingest import IngestJob
+        with open(args.export, 'rb') as f:
+            data = f.read()
+        job = IngestJob(data, hashlib.sha256(data).hexdigest()[:16], engine, db_dir, report_columns).start()
+        while not job.done:
+            time.sleep(0.2)
+        if job.error:
+            raise SystemExit(job.error)
+        get_dataset = lambda: job.result
+
+    server = AggregatesServer((args.host, args.port), get_dataset, settings)
+    print(f"Serving case aggregates on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,14 @@ import streamlit.components.v1 as components
 from dotenv import load_dotenv
 import os
 import plotly.io as pio
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+import aggregates
+from aggregates import KEY_PRODUCT_LINES, COMPARISON_PRESETS, AGE_PERCENTILES
+from ingest import MAX_DATASETS, get_ingest_job, only_dataset
+from api import serve_in_background
+from watcher import FolderWatcher
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(
@@ -34,6 +42,24 @@ CLOSED_STATUSES = get_status_list("CLOSED_STATUSES")
 OPEN_STATUSESAVG = get_status_list("OPEN_STATUSES_AVG")
 selected_owners = get_status_list("SELECTED_OWNERS")
 
+# Where the dashboard's queries run: "pandas" (default), "duckdb" or "sqlite".
+# CASE_DB_DIR keeps the SQL engines' database on disk instead of in memory.
+CASE_BACKEND = os.getenv("CASE_BACKEND", "pandas").strip().lower()
+CASE_DB_DIR = os.getenv("CASE_DB_DIR", "").strip() or None
+INGEST_POLL_SECONDS = 0.5
+# Optional folder the CRM drops its scheduled exports into; shown whenever nothing is uploaded
+WATCH_DIR = os.getenv("WATCH_DIR", "").strip() or None
+WATCH_INTERVAL_SECONDS = int(os.getenv("WATCH_INTERVAL_SECONDS", "30"))
+# Extra export columns kept for the detailed reports on top of the ones the
+# dashboard reads itself; "*" keeps every column of the export.
+REPORT_COLUMNS = None if os.getenv("REPORT_COLUMNS", "").strip() == "*" else (
+    get_status_list("REPORT_COLUMNS") or ["Case Number", "Subject"])
+# Threads shared by all sessions for computing dashboard sections side by side
+SECTION_WORKERS = int(os.getenv("SECTION_WORKERS", "0") or 0) or min(8, os.cpu_count() or 1)
+# Port of the local JSON aggregates API (see api.py); unset keeps it off. It serves the
+# WATCH_DIR dataset, or else the uploaded one while only a single upload is loaded.
+API_PORT = int(os.getenv("API_PORT", "0") or 0) or None
+
 def add_pdf_export():
     """
     Adds CSS for a perfectly structured, print-friendly PDF export and a button to trigger it.
@@ -144,47 +170,237 @@ def create_download_buttons(fig, df, file_name, index=False):
         )
 
 
+@st.cache_resource
+def get_section_executor():
+    """Thread pool the independent dashboard sections are computed on."""
+    return ThreadPoolExecutor(max_workers=SECTION_WORKERS, thread_name_prefix="section")
+
+
+def submit_section(fn, *args):
+    """Computes one section on the shared pool, remembered so the session's next run can cancel it."""
+    future = get_section_executor().submit(fn, *args)
+    st.session_state.setdefault('section_futures', []).append(future)
+    return future
+
+
+def cancel_stale_sections():
+    """Drops the sections an interrupted previous run of this session left queued.
+
+    A widget change stops the script mid-render, but its futures would still run
+    ahead of the new run's work in the queue every session shares.
+    """
+    for future in st.session_state.pop('section_futures', []):
+        future.cancel()
+
+
+def show_memory_report(dataset):
+    """Sidebar summary of how much memory the loaded dataset takes per column."""
+    report = dataset.memory_report
+    with st.sidebar.expander("Dataset Memory Report"):
+        st.metric(label="Stored Size (MB)", value=f"{report['Stored (KB)'].sum() / 1024:.1f}",
+                  delta=f"{(report['Stored (KB)'].sum() - report['Parsed (KB)'].sum()) / 1024:.1f} MB vs. parsed",
+                  delta_color="inverse")
+        skipped = len(dataset.dropped_columns)
+        if skipped:
+            total = len(report) + skipped
+            st.metric(label="Columns Stored", value=f"{len(report)} of {total}",
+                      delta=f"-{skipped} skipped at upload ({skipped / total:.0%} of the export's columns)",
+                      delta_color="inverse")
+        st.dataframe(report, hide_index=True)
+        if skipped:
+            st.caption(f"Skipped at upload: {', '.join(map(str, dataset.dropped_columns))}")
+        if REPORT_COLUMNS is not None:
+            st.caption("Detailed report downloads contain only the columns the dashboard uses plus "
+                       f"{', '.join(REPORT_COLUMNS)}. Set REPORT_COLUMNS=* to keep every column of the export.")
+
+
+@st.cache_resource
+def get_folder_watcher():
+    """Single watcher shared by every session, started on first use."""
+    return FolderWatcher(WATCH_DIR, CASE_BACKEND, CASE_DB_DIR, REPORT_COLUMNS, WATCH_INTERVAL_SECONDS).start()
+
+
+@st.cache_resource
+def start_api_server():
+    """Serves the aggregates of the current dataset as JSON next to the app.
+
+    Returns the server and None, or None and a warning when the port can't be bound;
+    the failure is cached too, so a busy port doesn't cost every rerun a retry.
+    """
+    settings = aggregates.Settings(OPEN_STATUSES, CLOSED_STATUSES, OPEN_STATUSESAVG, selected_owners)
+    # pinned to one source: the watched folder, else the upload as long as there is only one
+    get_dataset = only_dataset
+    if WATCH_DIR:
+        watcher = get_folder_watcher()
+        get_dataset = lambda: watcher.dataset
+    try:
+        return serve_in_background(get_dataset, settings, port=API_PORT), None
+    except OSError as e:
+        return None, f"Could not start the JSON API on port {API_PORT} ({e}). The dashboard itself is unaffected."
+
+
+@st.fragment(run_every=WATCH_INTERVAL_SECONDS)
+def watch_for_updates(watcher, seen_version):
+    """Reruns the whole page once the watcher has published a newer dataset."""
+    if watcher.version != seen_version:
+        st.rerun()
+    for error in watcher.error_messages:
+        st.warning(error)
+    if watcher.dataset is None:
+        st.info(f"Watching '{WATCH_DIR}' for exports: {watcher.status}.")
+    else:
+        updated = time.strftime('%d %b, %Y %H:%M', time.localtime(watcher.updated_at))
+        st.caption(f"Showing the latest export from '{WATCH_DIR}' (updated {updated}). Upload a file to analyse it instead.")
+
+
+@st.cache_data(max_entries=MAX_DATASETS, show_spinner=False)
+def get_weekly_cube(dataset_id, _backend, settings):
+    """Per-week counts of a dataset, computed once and shared by every comparison."""
+    return aggregates.weekly_cube(_backend, settings)
+
+
+@st.cache_data(max_entries=MAX_DATASETS, show_spinner=False)
+def get_aging_sketches(dataset_id, _backend, settings):
+    """Per product line and owner age sketches of a dataset, built once for all aging charts."""
+    return aggregates.aging_sketches(_backend, settings)
+
+
+def select_comparison_periods(min_available_date, max_available_date):
+    """Sidebar controls for the two periods; returns None until both are complete."""
+    today_date_obj = date.today()
+    anchor = today_date_obj if min_available_date <= today_date_obj <= max_available_date else max_available_date
+    preset = st.sidebar.selectbox("Compare", COMPARISON_PRESETS)
+    if preset != 'Custom':
+        return aggregates.preset_periods(preset, anchor)
+
+    def clamp(day):
+        # a short export may not reach back a full week or two before the anchor
+        return min(max(day, min_available_date), max_available_date)
+
+    week_start = anchor - timedelta(days=anchor.weekday())
+    current = st.sidebar.date_input("Current Period", (clamp(week_start), anchor),
+                                    min_value=min_available_date, max_value=max_available_date)
+    baseline = st.sidebar.date_input("Baseline Period",
+                                     (clamp(week_start - timedelta(weeks=1)), clamp(week_start - timedelta(days=1))),
+                                     min_value=min_available_date, max_value=max_available_date)
+    if len(current) != 2 or len(baseline) != 2:
+        st.sidebar.info("Pick a start and an end date for both periods.")
+        return None
+    return current, baseline
+
+
+def show_comparison(comparison):
+    """Renders the metric deltas, weekly overview and product line deltas of two periods."""
+    (current_start, current_end), (baseline_start, baseline_end) = comparison['current'], comparison['baseline']
+    st.header(f"Comparing {current_start.strftime('%d %b, %Y')} – {current_end.strftime('%d %b, %Y')} "
+              f"with {baseline_start.strftime('%d %b, %Y')} – {baseline_end.strftime('%d %b, %Y')}")
+    st.caption("Both periods are widened to whole Monday–Sunday weeks.")
+
+    st.subheader("Metrics for Cases Opened in Period")
+    for column, (label, (value, delta)) in zip(st.columns(3), comparison['metrics'].items()):
+        with column:
+            st.metric(label=label, value=value, delta=delta)
+
+    st.markdown("---")
+    st.markdown("##### Weekly Overview: Cases Opened and Closed")
+    st.dataframe(comparison['weekly'], hide_index=True)
+
+    st.markdown("---")
+    st.subheader("Change by Product Line")
+    by_product = comparison['by_product']
+    if by_product.empty:
+        st.info("No cases were opened or closed in either period.")
+        return
+    st.dataframe(by_product, hide_index=True)
+    chart_df = by_product.melt(id_vars='Product Line', value_vars=['Opened Change', 'Closed Change'],
+                               var_name='Measure', value_name='Change')
+    fig_change = px.bar(chart_df, x='Product Line', y='Change', color='Measure', barmode='group',
+                        title='Change vs. Baseline by Product Line',
+                        color_discrete_sequence=px.colors.qualitative.Vivid)
+    st.plotly_chart(fig_change, use_container_width=True)
+    create_download_buttons(fig_change, by_product, "period_comparison_by_product_line")
+
+
+def show_ingest_progress(job):
+    """Shows where a background ingest job is and polls until it finishes."""
+    progress = job.progress()
+    rows_read, total_rows = progress['rows_read'], progress['total_rows']
+    text = f"{progress['stage']}..."
+    fraction = 0.0
+    if total_rows:
+        fraction = min(rows_read / total_rows, 1.0)
+        text = f"{progress['stage']}: {rows_read:,} of ~{total_rows:,} rows"
+        if progress['eta'] is not None:
+            text += f" (about {progress['eta']:.0f}s left)"
+    st.progress(fraction, text=text)
+    st.caption(f"Processing the upload in the background ({progress['elapsed']:.0f}s so far). "
+               "The dashboard appears as soon as the data is ready.")
+    time.sleep(INGEST_POLL_SECONDS)
+    st.rerun()
+
+
 # --- APP TITLE ---
 st.title("📅 Case Analysis Dashboard")
 
 # --- FILE UPLOADER ---
 uploaded_file = st.file_uploader("Upload your Excel file to begin", type=['xlsx'])
 
+if API_PORT:
+    _, api_error = start_api_server()
+    if api_error:
+        st.warning(api_error)
+
+dataset = None
 if uploaded_file:
-    # Read and prepare the data
-    df = pd.read_excel(uploaded_file)
-    try:
-        df['Opened Date'] = pd.to_datetime(df['Opened Date'], dayfirst=True)
-        if 'Case Last Modified Date' in df.columns:
-            df['Case Last Modified Date'] = pd.to_datetime(df['Case Last Modified Date'], dayfirst=True)
-    except KeyError:
-        st.error("Error: The uploaded file must contain an 'Opened Date' column.")
-        st.stop()
-    except Exception as e:
-        st.error(f"Error processing Excel file: {e}")
+    # Read and prepare the data on a background thread; reruns reattach to the same job
+    file_bytes = uploaded_file.getvalue()
+    dataset_id = hashlib.sha256(file_bytes).hexdigest()[:16]
+    job = get_ingest_job(file_bytes, dataset_id, CASE_BACKEND, CASE_DB_DIR, REPORT_COLUMNS,
+                         current=st.session_state.get('ingest_job'))
+    st.session_state['ingest_job'] = job
+    if not job.done:
+        show_ingest_progress(job)
+    if job.error:
+        st.error(job.error)
         st.stop()
+    dataset = job.result
+elif WATCH_DIR:
+    watcher = get_folder_watcher()
+    # Version first: a dataset published in between only costs one extra rerun
+    seen_version = watcher.version
+    dataset = watcher.dataset
+    watch_for_updates(watcher, seen_version)
+
+if dataset is not None:
+    backend = dataset.backend
+    if dataset.warning:
+        st.warning(dataset.warning)
 
     # --- SIDEBAR FOR TIME FRAME SELECTION ---
     st.sidebar.header("Select Time Frame")
     selection_mode = st.sidebar.radio(
         "How do you want to select the time frame?",
-        ('By Date Range', 'By Week')
+        ('By Date Range', 'By Week', 'Compare Periods')
     )
     add_pdf_export()
+    show_memory_report(dataset)
 
     start_date = None
     end_date = None
+    comparison_periods = None
+
+    min_opened, max_opened = backend.date_bounds('Opened Date')
 
     if selection_mode == 'By Date Range':
-        min_available_date = df['Opened Date'].min().date()
-        max_available_date = df['Opened Date'].max().date()
+        min_available_date = min_opened.date()
+        max_available_date = max_opened.date()
         start_date = st.sidebar.date_input("Start Date", min_available_date, min_value=min_available_date, max_value=max_available_date)
         end_date = st.sidebar.date_input("End Date", max_available_date, min_value=min_available_date, max_value=max_available_date)
     
-    else: # By Week
+    elif selection_mode == 'By Week':
         today_date_obj = date.today()
-        min_available_date = df['Opened Date'].min().date()
-        max_available_date = df['Opened Date'].max().date()
+        min_available_date = min_opened.date()
+        max_available_date = max_opened.date()
         default_week_day = today_date_obj
         if not (min_available_date <= today_date_obj <= max_available_date):
             default_week_day = min_available_date
@@ -192,40 +408,48 @@ if uploaded_file:
         start_date = selected_day - timedelta(days=selected_day.weekday())
         end_date = start_date + timedelta(days=6)
 
+    else: # Compare Periods
+        comparison_periods = select_comparison_periods(min_opened.date(), max_opened.date())
+
     # --- MAIN CALCULATION AND DISPLAY ---
+    # --- SECTION COMPUTATIONS ---
+    # Every section below reads the same immutable dataset and none depends on another,
+    # so they are all submitted up front and only rendered here on the main thread.
+    settings = aggregates.Settings(OPEN_STATUSES, CLOSED_STATUSES, OPEN_STATUSESAVG, selected_owners)
+    today = date.today()
+    start_of_year = date(today.year, 1, 1)
+    cancel_stale_sections()
+    aging_sketches = get_aging_sketches(dataset.dataset_id, backend, settings)
+    ytd_sections = {
+        'product_ages': {product: submit_section(aggregates.product_age_trend, backend, product, start_of_year, today,
+                                                 settings, aging_sketches)
+                         for product in KEY_PRODUCT_LINES},
+    }
+    if selection_mode != 'Compare Periods':
+        # the comparison view replaces the period and YTD sections, so don't compute them
+        ytd_sections.update({
+            'drilldowns': {product: submit_section(aggregates.product_drilldown, backend, product, start_of_year, today, settings)
+                           for product in KEY_PRODUCT_LINES},
+            'backlog': submit_section(aggregates.ytd_backlog, backend, start_of_year, today, settings),
+            'average_age': submit_section(aggregates.average_age_trend, backend, start_of_year, today, settings),
+            'resolution': submit_section(aggregates.resolution_trend, backend, start_of_year, today, settings),
+        })
+
+    if comparison_periods:
+        cube = get_weekly_cube(dataset.dataset_id, backend, settings)
+        show_comparison(aggregates.compare_periods(cube, *comparison_periods))
+
     if start_date and end_date:
         start_date_dt = pd.to_datetime(start_date)
         end_date_dt = pd.to_datetime(end_date)
+        weekly_future = submit_section(aggregates.weekly_overview, backend, start_date, end_date, settings)
+        period_future = submit_section(aggregates.period_breakdowns, backend, start_date_dt, end_date_dt, settings)
         
         # --- Reports based on OPENED DATE ---
         st.header(f"Report for Cases Opened/Closed Between: {start_date_dt.strftime('%d %b, %Y')} and {end_date_dt.strftime('%d %b, %Y')}")
 
         # --- DYNAMIC SUMMARY BOXES ---
-        opened_summary_data = []
-        closed_summary_data = []
-
-        # Iterate through each week in the selected date range
-        for week_start in pd.date_range(start=start_date, end=end_date, freq='W-MON'):
-            week_end = week_start + timedelta(days=6)
-            
-            opened_mask = (df['Opened Date'] >= week_start) & (df['Opened Date'] <= week_end ) & (df['Status'].isin(OPEN_STATUSES))
-            opened_count = len(df[opened_mask])
-            
-            closed_count = 0
-            if 'Case Last Modified Date' in df.columns:
-                closed_mask = (df['Case Last Modified Date'] >= week_start) & (df['Case Last Modified Date'] <= week_end) & (df['Status'].isin(CLOSED_STATUSES))
-                closed_count = len(df[closed_mask])
-
-            week_num = week_start.isocalendar().week
-            year = week_start.isocalendar().year
-            date_range_str = f"{week_start.strftime('%m/%d/%Y')} – {week_end.strftime('%m/%d/%Y')}"
-            week_str = f"Week {week_num} FY {year} ({date_range_str})"
-            
-            opened_summary_data.append({'Week': week_str, 'Cases Opened': opened_count})
-            closed_summary_data.append({'Week': week_str, 'Cases Closed': closed_count})
-
-        opened_summary_df = pd.DataFrame(opened_summary_data)
-        closed_summary_df = pd.DataFrame(closed_summary_data)
+        opened_summary_df, closed_summary_df = weekly_future.result()
         
         box_col1, box_col2 = st.columns(2)
         with box_col1:
@@ -256,20 +480,11 @@ if uploaded_file:
         
         st.markdown("---")
 
-        cases_in_range = df[(df['Opened Date'] >= start_date_dt) & (df['Opened Date'] <= end_date_dt) & (df['Status'].isin(OPEN_STATUSES)) &
-                            (df['Case Owner'].isin(selected_owners))].copy()
-        
-        open_cases_data = cases_in_range[cases_in_range['Status'].isin(OPEN_STATUSES)].copy()
-        closed_cases_data = cases_in_range[cases_in_range['Status'].isin(CLOSED_STATUSES)].copy()
-        
-        closed_in_period_df = pd.DataFrame()
-        if 'Case Last Modified Date' in df.columns:
-             closed_in_period_df = df[
-                 
-                (df['Case Last Modified Date'] >= start_date_dt) & 
-                (df['Case Last Modified Date'] <= end_date_dt) &
-                (df['Status'].isin(CLOSED_STATUSES))
-            ].copy()
+        period = period_future.result()
+        cases_in_range = period['cases_in_range']
+        open_cases_data = cases_in_range
+        closed_cases_data = period['closed_cases_data']
+        closed_in_period_df = period['closed_in_period']
 
         st.subheader("Metrics for Cases Opened in Period")
         metric_col1, metric_col2, metric_col3 = st.columns(3)
@@ -312,20 +527,17 @@ if uploaded_file:
         st.markdown("##### All Cases Opened")
         report_col1, chart_col1 = st.columns(2)
         with report_col1:
-            if 'Case Reason' in df.columns:
+            if 'Case Reason' in backend.columns:
                 st.markdown("###### By Reason")
                 if not cases_in_range.empty:
-                    all_summary_df = cases_in_range.groupby(['Product Line', 'Case Reason']).size().reset_index(name='Record Count')
-                    total_all_count = all_summary_df['Record Count'].sum()
-                    total_row_all = pd.DataFrame([{'Product Line': '**Grand Total**', 'Case Reason': '', 'Record Count': total_all_count}])
-                    all_summary_df = pd.concat([all_summary_df, total_row_all], ignore_index=True)
+                    all_summary_df = aggregates.with_grand_total(period['all_by_reason'])
                     st.dataframe(all_summary_df)
             else:
                 st.warning("Missing 'Case Reason' column.")
         with chart_col1:
             st.markdown("###### By Product Line")
             if not cases_in_range.empty:
-                all_product_summary = cases_in_range.groupby('Product Line').size().reset_index(name='Record Count')
+                all_product_summary = period['all_by_product']
                 fig_all = px.pie(
                     all_product_summary, 
                     values='Record Count', 
@@ -342,13 +554,10 @@ if uploaded_file:
         st.markdown("##### Of Those Opened, Which Are Now Closed")
         report_col2, chart_col2 = st.columns(2)
         with report_col2:
-            if 'Case Reason' in df.columns:
+            if 'Case Reason' in backend.columns:
                 st.markdown("###### By Reason")
                 if not closed_cases_data.empty:
-                    closed_summary_df = closed_cases_data.groupby(['Product Line', 'Case Reason']).size().reset_index(name='Record Count')
-                    total_closed_count = closed_summary_df['Record Count'].sum()
-                    total_row_closed = pd.DataFrame([{'Product Line': '**Grand Total**', 'Case Reason': '', 'Record Count': total_closed_count}])
-                    closed_summary_df = pd.concat([closed_summary_df, total_row_closed], ignore_index=True)
+                    closed_summary_df = aggregates.with_grand_total(period['closed_by_reason'])
                     st.dataframe(closed_summary_df)
                 else:
                     st.info("No cases opened in this period are closed.")
@@ -358,7 +567,7 @@ if uploaded_file:
         with chart_col2:
             st.markdown("###### By Product Line")
             if not closed_cases_data.empty:
-                closed_product_summary = closed_cases_data.groupby('Product Line').size().reset_index(name='Record Count')
+                closed_product_summary = period['closed_by_product']
                 fig_closed = px.pie(
                     closed_product_summary, 
                     values='Record Count', 
@@ -373,22 +582,19 @@ if uploaded_file:
         st.markdown("---")
         
         st.header("Breakdown of Cases Closed in Selected Period")
-        if 'Case Last Modified Date' in df.columns and not closed_in_period_df.empty:
+        if 'Case Last Modified Date' in backend.columns and not closed_in_period_df.empty:
             report_col3, chart_col3 = st.columns(2)
             with report_col3:
-                if 'Case Reason' in df.columns:
+                if 'Case Reason' in backend.columns:
                     st.markdown("###### By Reason")
-                    closed_period_summary_df = closed_in_period_df.groupby(['Product Line', 'Case Reason']).size().reset_index(name='Record Count')
-                    total_closed_period_count = closed_period_summary_df['Record Count'].sum()
-                    total_row_closed_period = pd.DataFrame([{'Product Line': '**Grand Total**', 'Case Reason': '', 'Record Count': total_closed_period_count}])
-                    closed_period_summary_df = pd.concat([closed_period_summary_df, total_row_closed_period], ignore_index=True)
+                    closed_period_summary_df = aggregates.with_grand_total(period['closed_in_period_by_reason'])
                     st.dataframe(closed_period_summary_df)
                 else:
                     st.warning("Missing 'Case Reason' column.")
 
             with chart_col3:
                 st.markdown("###### By Product Line")
-                closed_in_period_summary = closed_in_period_df.groupby('Product Line').size().reset_index(name='Record Count')
+                closed_in_period_summary = period['closed_in_period_by_product']
                 fig_closed_period = px.pie(
                     closed_in_period_summary, 
                     values='Record Count', 
@@ -431,36 +637,24 @@ if uploaded_file:
         st.subheader("Additional Analysis (YTD Open Cases for Key Product Lines)")
         st.info("This section provides a separate breakdown of currently open cases (from YTD) for each of the key product lines: Barcode, RFID, PRI, and Reach.")
 
-        # Define YTD date range and the key product lines to analyze
-        today = date.today()
-        start_of_year = date(today.year, 1, 1)
-        key_product_lines = ['Barcode', 'RFID', 'PRI', 'Reach']
-        type = "RMA request"
-
         # Loop through each product line and create a separate analysis section
-        for product in key_product_lines:
+        for product in KEY_PRODUCT_LINES:
             st.markdown(f"#### Analysis for: **{product}**")
 
-            # Filter for open cases, within YTD, for the specific product line in this loop iteration
-            product_specific_data = df[
-                (df['Opened Date'] >= pd.to_datetime(start_of_year)) &
-                (df['Opened Date'] <= pd.to_datetime(today)) &
-                (df['Status'].isin(OPEN_STATUSES)) &
-                (df['Product Line'] == product) &
-                (df['Type']!=type) &
-                (df['Case Owner'].isin(selected_owners))
-            ].copy()
+            # Open cases, within YTD, for the specific product line in this loop iteration
+            drilldown = ytd_sections['drilldowns'][product].result()
+            product_open_count = drilldown['count']
 
             # --- THIS IS THE ADDED LINE ---
             # Display the total count for the current product using a metric card.
-            st.metric(label="Total Open Cases (YTD)", value=len(product_specific_data))
+            st.metric(label="Total Open Cases (YTD)", value=product_open_count)
 
-            if not product_specific_data.empty:
+            if product_open_count > 0:
                 drill_col1, drill_col2, drill_col3 = st.columns(3)
                 
                 with drill_col1:
-                    if 'Product Model' in df.columns:
-                        model_counts = product_specific_data.groupby('Product Model').size().reset_index(name='Count')
+                    if 'Product Model' in backend.columns:
+                        model_counts = drilldown['by_model']
                         if not model_counts.empty:
                             fig_model = px.pie(
                                 model_counts, 
@@ -475,8 +669,8 @@ if uploaded_file:
                             create_download_buttons(fig_model, model_counts, f"ytd_{product}_by_model")
 
                 with drill_col2:
-                    if 'Case Reason' in df.columns:
-                        reason_counts = product_specific_data.groupby('Case Reason').size().reset_index(name='Count')
+                    if 'Case Reason' in backend.columns:
+                        reason_counts = drilldown['by_reason']
                         if not reason_counts.empty:
                             fig_reason = px.pie(
                                 reason_counts, 
@@ -491,8 +685,8 @@ if uploaded_file:
                             create_download_buttons(fig_reason, reason_counts, f"ytd_{product}_by_reason")
                 
                 with drill_col3:
-                    if 'Case Owner' in df.columns:
-                        owner_counts = product_specific_data.groupby('Case Owner').size().reset_index(name='Count')
+                    if 'Case Owner' in backend.columns:
+                        owner_counts = drilldown['by_owner']
                         if not owner_counts.empty:
                             fig_owner = px.pie(
                                 owner_counts, 
@@ -506,30 +700,20 @@ if uploaded_file:
                             st.plotly_chart(fig_owner, use_container_width=True)
                             create_download_buttons(fig_owner, owner_counts, f"ytd_{product}_by_owner")
             # The info message below will now only show if the count is zero
-            elif len(product_specific_data) == 0:
+            elif product_open_count == 0:
                 st.info(f"No open cases found for '{product}' from the start of the year to date.")
             
             st.markdown("---") # Add a separator after each product line's analysis
         st.header("Year-to-Date Open Case Backlog Analysis")
         st.info("This analysis shows the backlog of open cases from January 1st to today, assigned only to Users Defined in .env file.")
 
-        today = date.today()
-        start_of_year = date(today.year, 1, 1)
-
         # First, ensure the 'Case Owner' column exists to prevent errors
-        if 'Case Owner' not in df.columns:
+        if 'Case Owner' not in backend.columns:
             st.warning("Cannot perform YTD Backlog Analysis: The 'Case Owner' column is missing.")
         else:
-            # Define the specific owners to include in the analysis
-            allowed_owners = ['Akhila Kotha', 'Manasa Lakshmi', 'Surendra Moilla']
-
-            # Apply all filters: date range, open statuses, and the allowed case owners
-            ytd_open_cases = df[
-                (df['Opened Date'] >= pd.to_datetime(start_of_year)) &
-                (df['Opened Date'] <= pd.to_datetime(today)) &
-                (df['Status'].isin(OPEN_STATUSES)) &
-                (df['Case Owner'].isin(allowed_owners))
-            ].copy()
+            # Date range, open statuses, and only the backlog owners (BACKLOG_OWNERS)
+            backlog = ytd_sections['backlog'].result()
+            ytd_open_cases = backlog['rows']
 
             if not ytd_open_cases.empty:
                 # Display the total count based on the filters
@@ -556,27 +740,27 @@ if uploaded_file:
                 ytd_row2_col1, ytd_row2_col2 = st.columns(2)
 
                 with ytd_row1_col1:
-                    ytd_product_counts = ytd_open_cases.groupby('Product Line').size().reset_index(name='Count')
+                    ytd_product_counts = backlog['by_product']
                     fig_ytd_product = px.pie(ytd_product_counts, values='Count', names='Product Line', title='By Product Line')
                     st.plotly_chart(fig_ytd_product, use_container_width=True)
                     create_download_buttons(fig_ytd_product, ytd_product_counts, "ytd_backlog_by_product")
                 
                 with ytd_row1_col2:
-                    if 'Product Model' in df.columns:
-                        ytd_model_counts = ytd_open_cases.groupby('Product Model').size().reset_index(name='Count')
+                    if 'Product Model' in backend.columns:
+                        ytd_model_counts = backlog['by_model']
                         fig_ytd_model = px.pie(ytd_model_counts, values='Count', names='Product Model', title='By Product Model')
                         st.plotly_chart(fig_ytd_model, use_container_width=True)
                         create_download_buttons(fig_ytd_model, ytd_model_counts, "ytd_backlog_by_model")
                 
                 with ytd_row2_col1:
-                    if 'Case Reason' in df.columns:
-                        ytd_reason_counts = ytd_open_cases.groupby('Case Reason').size().reset_index(name='Count')
+                    if 'Case Reason' in backend.columns:
+                        ytd_reason_counts = backlog['by_reason']
                         fig_ytd_reason = px.pie(ytd_reason_counts, values='Count', names='Case Reason', title='By Case Reason')
                         st.plotly_chart(fig_ytd_reason, use_container_width=True)
                         create_download_buttons(fig_ytd_reason, ytd_reason_counts, "ytd_backlog_by_reason")
                 
                 with ytd_row2_col2:
-                    ytd_owner_counts = ytd_open_cases.groupby('Case Owner').size().reset_index(name='Count')
+                    ytd_owner_counts = backlog['by_owner']
                     fig_ytd_owner = px.pie(ytd_owner_counts, values='Count', names='Case Owner', title='By Case Owner')
                     st.plotly_chart(fig_ytd_owner, use_container_width=True)
                     create_download_buttons(fig_ytd_owner, ytd_owner_counts, "ytd_backlog_by_owner")
@@ -588,9 +772,6 @@ if uploaded_file:
         st.header("Year-to-Date Performance Trends")
         st.info("These charts analyze trends from January 1st of the current year until today, independent of the date filter above.")
 
-        today = date.today()
-        start_of_year = date(today.year, 1, 1)
-
         # --- Specific owners to consider ---
 
 
@@ -598,36 +779,11 @@ if uploaded_file:
         st.markdown("##### Average Case Age (YTD)")
         st.caption("This chart shows the average number of days open cases have remained open for the **Barcode, RFID, PRI, and Reach** product lines, calculated weekly from the start of the year.")
 
-        key_product_lines = ['Barcode', 'RFID', 'PRI', 'Reach']
-
-        # ✅ Filter only open cases for selected owners
-        all_open_cases_ytd = df[
-            (df['Status'].isin(OPEN_STATUSESAVG)) &
-            (df['Product Line'].isin(key_product_lines)) &
-            (df['Case Owner'].isin(selected_owners)) &
-            (df['Type'] != type)
-        ].copy()
-
-        if not all_open_cases_ytd.empty:
-            # Ensure Opened Date is datetime
-            all_open_cases_ytd['Opened Date'] = pd.to_datetime(all_open_cases_ytd['Opened Date'], errors='coerce')
-            all_open_cases_ytd = all_open_cases_ytd.dropna(subset=['Opened Date'])
-
-            daily_avg_age_data = []
-
-            # --- Calculate age dynamically ---
-            for day in pd.date_range(start=start_of_year, end=today):
-                open_on_day = all_open_cases_ytd[all_open_cases_ytd['Opened Date'] <= day]
-                if not open_on_day.empty:
-                    ages = (day - open_on_day['Opened Date']).dt.days
-                    avg_age = ages.mean()
-                    daily_avg_age_data.append({'Date': day, 'Average Age (Days)': avg_age})
-
-            if daily_avg_age_data:
-                trend_df = pd.DataFrame(daily_avg_age_data).set_index('Date')
-                weekly_trend_df = trend_df.resample('W-Mon').mean().reset_index()
-                weekly_trend_df['Week Number'] = weekly_trend_df.index
+        # ✅ Only open cases for selected owners
+        weekly_trend_df = ytd_sections['average_age'].result()
 
+        if weekly_trend_df is not None:
+            if not weekly_trend_df.empty:
                 # --- Plotly Chart ---
                 fig_age_trend = px.line(
                     weekly_trend_df,
@@ -668,60 +824,12 @@ if uploaded_file:
         st.markdown("##### Average Resolution Time (YTD)")
         st.caption("This chart shows the average number of days taken to close or the current age of cases (only specific open and closed statuses), calculated weekly from the start of the year.")
 
-        OPEN_STATUSES = ['New', 'In Process', 'Waiting for customer response', 'ON HOLD (Bug/Enhancement)', 'Reopened']
-        CLOSED_STATUSES = ['Closed - Complete']
-
-        if 'Case Last Modified Date' in df.columns:
-
-            # --- Filter dataset for relevant statuses ---
-            relevant_cases_ytd = df[
-                (df['Status'].isin(OPEN_STATUSESAVG + CLOSED_STATUSES)) &
-                (df['Opened Date'] >= pd.to_datetime(start_of_year)) &
-                (df['Type'] != type)
-            ].copy()
-
-            if not relevant_cases_ytd.empty:
-                weekly_avg_data = []
-
-                # Iterate weekly through the year
-                for week_start in pd.date_range(start=start_of_year, end=today, freq='W-MON'):
-
-                    # --- OPEN CASES: calculate how long they've been open so far ---
-                    open_cases = relevant_cases_ytd[
-                        relevant_cases_ytd['Status'].isin(OPEN_STATUSESAVG) &
-                        (relevant_cases_ytd['Opened Date'] <= week_start)
-                    ]
-                    avg_open_age = None
-                    if not open_cases.empty:
-                        open_cases['Age (Days)'] = (week_start - open_cases['Opened Date']).dt.days
-                        avg_open_age = open_cases['Age (Days)'].mean()
-
-                    # --- CLOSED CASES: calculate resolution time ---
-                    closed_cases = relevant_cases_ytd[
-                        (relevant_cases_ytd['Status'].isin(CLOSED_STATUSES)) &
-                        (relevant_cases_ytd['Case Last Modified Date'] <= week_start)
-                    ]
-                    avg_closed_time = None
-                    if not closed_cases.empty:
-                        closed_cases['Resolution Time (Days)'] = (
-                            closed_cases['Case Last Modified Date'] - closed_cases['Opened Date']
-                        ).dt.days
-                        closed_cases = closed_cases[closed_cases['Resolution Time (Days)'] >= 0]
-                        avg_closed_time = closed_cases['Resolution Time (Days)'].mean()
-
-                    # Combine both into a single average if any data exists
-                    valid_averages = [v for v in [avg_open_age, avg_closed_time] if v is not None]
-                    if valid_averages:
-                        combined_avg = sum(valid_averages) / len(valid_averages)
-                        weekly_avg_data.append({
-                            'Week Start': week_start,
-                            'Average Time (Days)': combined_avg
-                        })
-
-                if weekly_avg_data:
-                    weekly_trend_df = pd.DataFrame(weekly_avg_data)
-                    weekly_trend_df['Week Number'] = range(1, len(weekly_trend_df) + 1)
+        # Only OPEN_STATUSES_AVG and RESOLUTION_CLOSED_STATUSES are considered here
+        if 'Case Last Modified Date' in backend.columns:
+            weekly_trend_df = ytd_sections['resolution'].result()
 
+            if weekly_trend_df is not None:
+                if not weekly_trend_df.empty:
                     # --- Plotly line chart ---
                     fig_close_trend = px.line(
                         weekly_trend_df,
@@ -761,52 +869,29 @@ if uploaded_file:
         # --- Charts 3-6: Average Case Age by Product Line ---
     st.subheader("Average Case Age by Product Line (YTD) Without RMA")
 
-    key_product_lines_for_loop = ['Barcode', 'RFID', 'PRI', 'Reach']
-
-    for product in key_product_lines_for_loop:
+    for product in KEY_PRODUCT_LINES:
         st.markdown(f"##### Trend for: **{product}**")
-        st.caption("This shows the average number of days open cases for this product have been active, calculated weekly (Year-to-Date).")
-
-        # Filter for open cases (excluding RMA type)
-        product_specific_open_cases = df[
-            (df['Status'].isin(OPEN_STATUSESAVG)) &
-            (df['Product Line'] == product) &
-            (df['Case Owner'].isin(selected_owners)) &
-            (df['Type'] != type)
-        ].copy()
-
-        if not product_specific_open_cases.empty:
-            # Create a DataFrame for each Monday in the year (weekly points)
-            weekly_avg_age_data = []
-            for week_start in pd.date_range(start=start_of_year, end=today, freq='W-MON'):
-                open_on_week = product_specific_open_cases[
-                    product_specific_open_cases['Opened Date'] <= week_start
-                ]
-                if not open_on_week.empty:
-                    open_on_week['Age (Days)'] = (week_start - open_on_week['Opened Date']).dt.days
-                    avg_age = open_on_week['Age (Days)'].mean()
-                    weekly_avg_age_data.append({
-                        'Week Start': week_start,
-                        'Average Age (Days)': avg_age
-                    })
-
-            if weekly_avg_age_data:
-                weekly_trend_df_product = pd.DataFrame(weekly_avg_age_data)
-                weekly_trend_df_product['Week Number'] = range(1, len(weekly_trend_df_product) + 1)
+        st.caption("This shows the average, median and 90th percentile number of days open cases for this product have been active, calculated weekly (Year-to-Date).")
+
+        # Open cases (excluding RMA type), one point for each Monday in the year
+        weekly_trend_df_product = ytd_sections['product_ages'][product].result()
 
+        if weekly_trend_df_product is not None:
+            if not weekly_trend_df_product.empty:
                 # --- Plotly line chart ---
                 fig_product_trend = px.line(
                     weekly_trend_df_product,
                     x='Week Number',
-                    y='Average Age (Days)',
+                    y=['Average Age (Days)', *AGE_PERCENTILES],
                     markers=True,
                     line_shape='spline',
-                    title=f'Average Case Age Trend (YTD) - {product}'
+                    title=f'Case Age Trend (YTD) - {product}'
                 )
 
                 fig_product_trend.update_layout(
                     height=450,
-                    yaxis_title="Average Case Age (Days)",
+                    yaxis_title="Case Age (Days)",
+                    legend_title_text="",
                     xaxis_title="Week Number (Since Start of Year)",
                     xaxis=dict(
                         tickmode='linear',
@@ -824,8 +909,36 @@ if uploaded_file:
         else:
             st.info(f"No open cases found for '{product}' to analyze YTD age trend.")
 
+    # --- Chart 7: Age Percentiles by Owner ---
+    st.subheader("Open Case Age Percentiles by Owner (YTD) Without RMA")
+    st.caption("Median and 90th percentile number of days each owner's open cases have been active across all product lines, calculated weekly (Year-to-Date). Unlike the average, neither is pulled up by a handful of very old cases.")
+    owner_ages_df = aggregates.owner_age_percentiles(aging_sketches, selected_owners, start_of_year, today)
+    if not owner_ages_df.empty:
+        owner_chart_df = owner_ages_df.melt(id_vars=['Week Number', 'Case Owner'], value_vars=list(AGE_PERCENTILES),
+                                            var_name='Percentile', value_name='Age (Days)')
+        fig_owner_ages = px.line(
+            owner_chart_df,
+            x='Week Number',
+            y='Age (Days)',
+            color='Case Owner',
+            line_dash='Percentile',
+            markers=True,
+            title='Median and P90 Open Case Age by Owner (YTD)'
+        )
+        fig_owner_ages.update_layout(
+            height=450,
+            yaxis_title="Case Age (Days)",
+            xaxis_title="Week Number (Since Start of Year)",
+            xaxis=dict(tickmode='linear', dtick=1, tickangle=-45, tickfont=dict(size=10), automargin=True),
+            margin=dict(l=50, r=30, t=70, b=120),
+        )
+        st.plotly_chart(fig_owner_ages, use_container_width=True)
+        create_download_buttons(fig_owner_ages, owner_ages_df, "ytd_case_age_percentiles_by_owner")
+    else:
+        st.info("No open cases found for the selected owners to analyze YTD age percentiles.")
+
 
-else:
+elif not WATCH_DIR:
     st.info("Please upload an Excel file to get started.")
 
 
@@ -0,0 +1,443 @@
+"""
+Query backends for the case dashboard.
+
+The dashboard only ever asks a handful of questions of the case export:
+how many rows match a filter, how they split by a column, how many fall
+into each week, and how old the open ones are. This module expresses those
+questions once against a `CaseFilter` and answers them either in pandas
+(the default) or by pushing them down to an embedded DuckDB/SQLite database.
+
+Both backends first turn each date column into int32 day ordinals (days
+since 1970-01-01) with the ISO year and week of every day, once per dataset.
+Every date filter then compares whole days over half-open intervals
+`[first_day, last_day + 1)`, so a case opened late on the last day of a
+range is still in it, and ages are differences of calendar days.
+"""
+import os
+import sqlite3
+import threading
+import uuid
+import weakref
+from collections import namedtuple
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+try:
+    import duckdb
+except ImportError:  # optional, only needed for CASE_BACKEND=duckdb
+    duckdb = None
+
+OPENED = 'Opened Date'
+MODIFIED = 'Case Last Modified Date'
+DATE_COLUMNS = [OPENED, MODIFIED]
+
+ENGINES = ('pandas', 'duckdb', 'sqlite')
+
+EPOCH = pd.Timestamp(0)
+ROW_LABEL = '__row'
+WEEK_START = 'Week Start'
+DAY = 'Day'
+
+# Names of the day ordinal and ISO calendar columns derived from each date column
+DayColumns = namedtuple('DayColumns', ['day', 'iso_year', 'iso_week'])
+DAY_COLUMNS = {
+    OPENED: DayColumns('__opened_day', '__opened_iso_year', '__opened_iso_week'),
+    MODIFIED: DayColumns('__modified_day', '__modified_iso_year', '__modified_iso_week'),
+}
+
+DayOrdinals = namedtuple('DayOrdinals', ['day', 'iso_year', 'iso_week', 'valid'])
+
+
+def day_ordinal(value):
+    """Days since 1970-01-01 of a date or timestamp; any time of day is dropped."""
+    return (pd.Timestamp(value).normalize() - EPOCH).days
+
+
+def day_ordinals(values):
+    """Day ordinals and ISO year/week of a datetime Series, with a mask of the non-missing rows.
+
+    Missing dates get day 0 and must be excluded through `valid`.
+    """
+    valid = values.notna().to_numpy()
+    days = values.dt.floor('D').to_numpy().astype('datetime64[D]').astype('int64')
+    days = np.where(valid, days, 0).astype('int32')
+    # the calendar only has to be worked out once per distinct day
+    unique_days, inverse = np.unique(days, return_inverse=True)
+    calendar = pd.DatetimeIndex(unique_days.astype('datetime64[D]')).isocalendar()
+    iso_year = calendar['year'].to_numpy(dtype='int16')[inverse]
+    iso_week = calendar['week'].to_numpy(dtype='int8')[inverse]
+    return DayOrdinals(days, iso_year, iso_week, valid)
+
+
+def iso_week_starts(iso_year, iso_week):
+    """Monday of each ISO (year, week) pair, as timestamps."""
+    labels = [f'{year}-W{week:02d}-1' for year, week in zip(iso_year, iso_week)]
+    return pd.to_datetime(pd.Series(labels, dtype=object), format='%G-W%V-%u')
+
+
+@dataclass(frozen=True)
+class CaseFilter:
+    """Row filter shared by every backend.
+
+    Date bounds are whole days, given as dates or timestamps whose time is
+    ignored: `*_from` is the first day included and `*_to` the last. List
+    filters use `None` for "don't filter" and an empty tuple for "match
+    nothing", the same way `Series.isin([])` behaves.
+    """
+    opened_from: pd.Timestamp = None
+    opened_to: pd.Timestamp = None
+    modified_from: pd.Timestamp = None
+    modified_to: pd.Timestamp = None
+    statuses: tuple = None
+    owners: tuple = None
+    product_lines: tuple = None
+    exclude_type: str = None
+
+
+def _day_bounds(flt):
+    """(date column, first day, day after the last) for every date bound of the filter."""
+    for column, first, last in ((OPENED, flt.opened_from, flt.opened_to),
+                                (MODIFIED, flt.modified_from, flt.modified_to)):
+        if first is not None or last is not None:
+            yield (column,
+                   None if first is None else day_ordinal(first),
+                   None if last is None else day_ordinal(last) + 1)
+
+
+# --- PANDAS BACKEND ---
+class PandasBackend:
+    """Answers queries directly on the in-memory DataFrame."""
+
+    engine = 'pandas'
+
+    def __init__(self, df):
+        self.df = df
+        self.columns = list(df.columns)
+        self._days = {column: day_ordinals(df[column]) for column in DATE_COLUMNS if column in df.columns}
+
+    def _mask(self, flt):
+        df = self.df
+        mask = np.ones(len(df), dtype=bool)
+        for column, first, end in _day_bounds(flt):
+            ordinals = self._days[column]
+            mask &= ordinals.valid
+            if first is not None:
+                mask &= ordinals.day >= first
+            if end is not None:
+                mask &= ordinals.day < end
+        if flt.statuses is not None:
+            mask &= df['Status'].isin(flt.statuses).to_numpy()
+        if flt.owners is not None:
+            mask &= df['Case Owner'].isin(flt.owners).to_numpy()
+        if flt.product_lines is not None:
+            mask &= df['Product Line'].isin(flt.product_lines).to_numpy()
+        if flt.exclude_type is not None:
+            mask &= (df['Type'] != flt.exclude_type).to_numpy()
+        return mask
+
+    def _matching_days(self, flt, column):
+        ordinals = self._days[column]
+        return ordinals.day[self._mask(flt) & ordinals.valid]
+
+    def date_bounds(self, column=OPENED):
+        return self.df[column].min(), self.df[column].max()
+
+    def rows(self, flt):
+        return self.df[self._mask(flt)].copy()
+
+    def count(self, flt):
+        return int(self._mask(flt).sum())
+
+    def group_counts(self, flt, by, name='Count'):
+        return self.df[self._mask(flt)].groupby(by, observed=True).size().reset_index(name=name)
+
+    def window_counts(self, flt, column, windows):
+        """Number of matching rows with `column` on the days of each inclusive (first, last) window."""
+        days = np.sort(self._matching_days(flt, column))
+        firsts = np.searchsorted(days, [day_ordinal(first) for first, _ in windows], side='left')
+        ends = np.searchsorted(days, [day_ordinal(last) + 1 for _, last in windows], side='left')
+        return [int(count) for count in ends - firsts]
+
+    def weekly_group_counts(self, flt, column, by, name='Count'):
+        """Matching rows per ISO week of `column` and value of `by`.
+
+        Unlike `group_counts`, rows with a missing `by` value are kept as
+        their own group so the weekly totals stay complete.
+        """
+        ordinals = self._days[column]
+        keep = self._mask(flt) & ordinals.valid
+        keys = pd.DataFrame({'year': ordinals.iso_year[keep], 'week': ordinals.iso_week[keep]})
+        keys[by] = self.df[by].to_numpy()[keep]
+        counts = keys.groupby(['year', 'week', by], observed=True, dropna=False).size().reset_index(name=name)
+        counts.insert(0, WEEK_START, iso_week_starts(counts['year'], counts['week']))
+        return counts.drop(columns=['year', 'week'])
+
+    def day_counts(self, flt, column, by, name='Count'):
+        """Matching rows per value of the `by` columns and day ordinal of `column`."""
+        ordinals = self._days[column]
+        keep = self._mask(flt) & ordinals.valid
+        keys = pd.DataFrame({c: self.df[c].to_numpy()[keep] for c in by})
+        keys[DAY] = ordinals.day[keep]
+        return keys.groupby(by + [DAY], observed=True, dropna=False).size().reset_index(name=name)
+
+    def mean_age(self, flt, points):
+        """Mean age in days of matching cases opened on or before each point's day.
+
+        A case opened on the day of a point counts with age 0. Points with
+        no such cases are left out of the result.
+        """
+        points = list(points)
+        opened = np.sort(self._matching_days(flt, OPENED)).astype('int64')
+        point_days = np.array([day_ordinal(p) for p in points], dtype='int64')
+        # running sums over the sorted opening days answer every point with one search
+        counts = np.searchsorted(opened, point_days, side='right')
+        totals = np.concatenate([[0], np.cumsum(opened)])[counts]
+        result = {point: day - total / count
+                  for point, day, total, count in zip(points, point_days, totals, counts) if count}
+        return pd.Series(result, dtype='float64')
+
+    def mean_resolution(self, flt, points):
+        """Mean resolution time in days of matching cases modified on or before each point's day.
+
+        Negative resolution times are ignored; a point whose cases are all
+        negative yields NaN rather than being left out.
+        """
+        points = list(points)
+        opened, modified = self._days[OPENED], self._days[MODIFIED]
+        keep = self._mask(flt) & opened.valid & modified.valid
+        order = np.argsort(modified.day[keep], kind='stable')
+        closed_days = modified.day[keep][order].astype('int64')
+        resolution = closed_days - opened.day[keep][order]
+        non_negative = resolution >= 0
+        point_days = np.array([day_ordinal(p) for p in points], dtype='int64')
+        counts = np.searchsorted(closed_days, point_days, side='right')
+        valid_counts = np.concatenate([[0], np.cumsum(non_negative)])[counts]
+        totals = np.concatenate([[0], np.cumsum(np.where(non_negative, resolution, 0))])[counts]
+        result = {point: (total / valid if valid else float('nan'))
+                  for point, total, valid, count in zip(points, totals, valid_counts, counts) if count}
+        return pd.Series(result, dtype='float64')
+
+
+# --- SQL BACKEND ---
+def _quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def _in_clause(column, values, params):
+    if not values:
+        return '1 = 0'
+    params.extend(values)
+    return f"{_quote(column)} IN ({', '.join('?' * len(values))})"
+
+
+def _where(flt, params):
+    clauses = []
+    for column, first, end in _day_bounds(flt):
+        day = _quote(DAY_COLUMNS[column].day)
+        if first is not None:
+            clauses.append(f'{day} >= ?')
+            params.append(first)
+        if end is not None:
+            clauses.append(f'{day} < ?')
+            params.append(end)
+    for column, values in (
+        ('Status', flt.statuses),
+        ('Case Owner', flt.owners),
+        ('Product Line', flt.product_lines),
+    ):
+        if values is not None:
+            clauses.append(_in_clause(column, list(values), params))
+    if flt.exclude_type is not None:
+        # pandas keeps missing types on `!=`, SQL would drop them
+        clauses.append('("Type" IS NULL OR "Type" <> ?)')
+        params.append(flt.exclude_type)
+    return ' AND '.join(clauses) or '1 = 1'
+
+
+def _points_cte(points, params):
+    """CTE listing the query points as day ordinals, shared by both engines."""
+    params.extend(day_ordinal(p) for p in points)
+    return f"WITH points(p) AS (VALUES {', '.join(['(?)'] * len(points))}) "
+
+
+class SQLBackend:
+    """Pushes queries down to an embedded DuckDB or SQLite database.
+
+    Date columns are stored as integer epoch seconds so detailed reports
+    round-trip exactly; filters and ages only read the derived day ordinal
+    columns, so both engines share one SQL dialect of integer comparisons.
+    """
+
+    def __init__(self, df, engine='duckdb', path=None):
+        if engine not in ('duckdb', 'sqlite'):
+            raise ValueError(f"Unknown SQL engine: {engine}")
+        self.engine = engine
+        self.columns = list(df.columns)
+        self.path = path
+        self._lock = threading.Lock()
+
+        # keep the original row labels so detailed reports match the pandas backend
+        table = df.reset_index(names=ROW_LABEL)
+        for column in DATE_COLUMNS:
+            if column in table.columns:
+                ordinals = day_ordinals(table[column])
+                names = DAY_COLUMNS[column]
+                for name, values, dtype in ((names.day, ordinals.day, 'Int32'),
+                                            (names.iso_year, ordinals.iso_year, 'Int16'),
+                                            (names.iso_week, ordinals.iso_week, 'Int8')):
+                    table[name] = pd.array(values, dtype=dtype)
+                    table.loc[~ordinals.valid, name] = pd.NA
+                seconds = table[column].astype('datetime64[s]').astype('int64')
+                table[column] = seconds.astype('Int64').mask(table[column].isna())
+        for column in table.columns[table.dtypes == object]:
+            table[column] = table[column].map(lambda v: v if pd.isna(v) else str(v))
+
+        if engine == 'duckdb':
+            if duckdb is None:
+                raise ImportError("the 'duckdb' package is not installed")
+            self._con = duckdb.connect(path or ':memory:')
+            self._con.register('cases_frame', table)
+            self._con.execute('CREATE OR REPLACE TABLE cases AS SELECT * FROM cases_frame')
+            self._con.unregister('cases_frame')
+        else:
+            self._con = sqlite3.connect(path or ':memory:', check_same_thread=False)
+            table.to_sql('cases', self._con, index=False, if_exists='replace')
+        # closes the connection and deletes an on-disk database once the backend is garbage collected
+        weakref.finalize(self, _drop_database, self._con, path)
+
+    def _query(self, sql, params):
+        if self.engine == 'duckdb':
+            # a cursor is an independent connection to the same database
+            return self._con.cursor().execute(sql, params).fetchall()
+        with self._lock:
+            return self._con.execute(sql, params).fetchall()
+
+    def _frame(self, sql, params, columns):
+        frame = pd.DataFrame(self._query(sql, params), columns=columns)
+        for column in DATE_COLUMNS:
+            if column in frame.columns:
+                frame[column] = pd.to_datetime(frame[column], unit='s')
+        return frame
+
+    def date_bounds(self, column=OPENED):
+        low, high = self._query(f'SELECT MIN({_quote(column)}), MAX({_quote(column)}) FROM cases', [])[0]
+        return pd.to_datetime(low, unit='s'), pd.to_datetime(high, unit='s')
+
+    def rows(self, flt):
+        params = []
+        columns = [ROW_LABEL] + self.columns
+        sql = (f"SELECT {', '.join(_quote(c) for c in columns)} FROM cases "
+               f'WHERE {_where(flt, params)} ORDER BY {ROW_LABEL}')
+        frame = self._frame(sql, params, columns)
+        return frame.set_index(ROW_LABEL).rename_axis(None)
+
+    def count(self, flt):
+        params = []
+        return int(self._query(f'SELECT COUNT(*) FROM cases WHERE {_where(flt, params)}', params)[0][0])
+
+    def group_counts(self, flt, by, name='Count'):
+        by = [by] if isinstance(by, str) else list(by)
+        keys = ', '.join(_quote(c) for c in by)
+        not_null = ' AND '.join(f'{_quote(c)} IS NOT NULL' for c in by)
+        params = []
+        sql = (f'SELECT {keys}, COUNT(*) FROM cases WHERE {_where(flt, params)} AND {not_null} '
+               f'GROUP BY {keys} ORDER BY {keys}')
+        return self._frame(sql, params, by + [name])
+
+    def window_counts(self, flt, column, windows):
+        if not windows:
+            return []
+        params = []
+        for first, last in windows:
+            params.extend([day_ordinal(first), day_ordinal(last) + 1])
+        cte = f"WITH windows(i, lo, hi) AS (VALUES {', '.join(f'({i}, ?, ?)' for i in range(len(windows)))}) "
+        day = f'c.{_quote(DAY_COLUMNS[column].day)}'
+        sql = (cte + 'SELECT w.i, COUNT(' + day + ') FROM windows w '
+               f'LEFT JOIN (SELECT * FROM cases WHERE {_where(flt, params)}) c '
+               f'ON {day} >= w.lo AND {day} < w.hi GROUP BY w.i ORDER BY w.i')
+        return [int(count) for _, count in self._query(sql, params)]
+
+    def weekly_group_counts(self, flt, column, by, name='Count'):
+        params = []
+        names = DAY_COLUMNS[column]
+        year, week = _quote(names.iso_year), _quote(names.iso_week)
+        sql = (f'SELECT {year}, {week}, {_quote(by)}, COUNT(*) FROM cases '
+               f'WHERE {_where(flt, params)} AND {_quote(names.day)} IS NOT NULL '
+               'GROUP BY 1, 2, 3 ORDER BY 1, 2, 3')
+        counts = pd.DataFrame(self._query(sql, params), columns=['year', 'week', by, name])
+        counts.insert(0, WEEK_START, iso_week_starts(counts['year'], counts['week']))
+        return counts.drop(columns=['year', 'week'])
+
+    def day_counts(self, flt, column, by, name='Count'):
+        params = []
+        day = _quote(DAY_COLUMNS[column].day)
+        keys = ', '.join(_quote(c) for c in by)
+        positions = ', '.join(str(i + 1) for i in range(len(by) + 1))
+        sql = (f'SELECT {keys}, {day}, COUNT(*) FROM cases WHERE {_where(flt, params)} AND {day} IS NOT NULL '
+               f'GROUP BY {positions} ORDER BY {positions}')
+        frame = pd.DataFrame(self._query(sql, params), columns=by + [DAY, name])
+        frame[DAY] = frame[DAY].astype('int64')
+        return frame
+
+    def _series(self, rows, points):
+        by_day = {day_ordinal(p): p for p in points}
+        values = {by_day[p]: (float('nan') if v is None else float(v)) for p, v in rows}
+        return pd.Series(values, dtype='float64').reindex([p for p in points if p in values])
+
+    def mean_age(self, flt, points):
+        points = list(points)
+        if not points:
+            return pd.Series(dtype='float64')
+        params = []
+        cte = _points_cte(points, params)
+        opened = f'c.{_quote(DAY_COLUMNS[OPENED].day)}'
+        sql = (cte + f'SELECT p, AVG(p - {opened}) FROM points '
+               f'JOIN (SELECT * FROM cases WHERE {_where(flt, params)}) c ON {opened} <= p '
+               'GROUP BY p ORDER BY p')
+        return self._series(self._query(sql, params), points)
+
+    def mean_resolution(self, flt, points):
+        points = list(points)
+        if not points:
+            return pd.Series(dtype='float64')
+        params = []
+        cte = _points_cte(points, params)
+        modified = f'c.{_quote(DAY_COLUMNS[MODIFIED].day)}'
+        delta = f'{modified} - c.{_quote(DAY_COLUMNS[OPENED].day)}'
+        sql = (cte + f'SELECT p, AVG(CASE WHEN {delta} >= 0 THEN {delta} END) FROM points '
+               f'JOIN (SELECT * FROM cases WHERE {_where(flt, params)}) c ON {modified} <= p '
+               'GROUP BY p ORDER BY p')
+        return self._series(self._query(sql, params), points)
+
+
+def _drop_database(con, path):
+    con.close()
+    if path:
+        # along with the write-ahead and journal files the engines may leave next to it
+        for suffix in ('', '.wal', '-journal', '-wal', '-shm'):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+
+
+def open_backend(df, engine='pandas', db_dir=None, dataset_id=None):
+    """Builds the backend selected by `engine` for an already parsed case export.
+
+    With `db_dir` set the SQL engines keep their database in a file named
+    after `dataset_id` instead of in memory. The file is deleted once the
+    backend is no longer referenced, i.e. when its dataset has been evicted
+    and no session shows it any more.
+    """
+    if engine == 'pandas':
+        return PandasBackend(df)
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown CASE_BACKEND '{engine}', expected one of {', '.join(ENGINES)}")
+    path = None
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+        # unique per backend, so a re-ingested dataset never shares the file of one being dropped
+        path = os.path.join(db_dir, f"cases_{dataset_id or 'latest'}_{uuid.uuid4().hex[:8]}.{engine}")
+    return SQLBackend(df, engine=engine, path=path)
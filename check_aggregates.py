@@ -0,0 +1,179 @@
+"""
+Consistency check for the computation layer.
+
+Reads a synthetic export through the real ingest path, answers every
+dashboard aggregate with each backend engine and asserts that the pandas,
+DuckDB and SQLite answers are identical, for the whole team and narrowed
+to one product line and owner. It also checks the median and p90 ages
+from the day histogram sketches against numpy.quantile on the raw ages.
+
+    python check_aggregates.py --rows 5000
+    python check_aggregates.py --engines pandas sqlite --seed 3
+
+Exits non-zero on the first difference, naming the aggregate and engine.
+"""
+import argparse
+import io
+import math
+import sys
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import aggregates
+from backend import ENGINES, WEEK_START, open_backend
+from ingest import compact_frame, parse_dates, read_workbook
+from load_test import DEFAULT_ENV, OWNERS, PRODUCT_LINES, make_export
+from sketch import DayHistogram
+
+PERIOD_DAYS = (120, 30)   # the selected period runs from 120 to 30 days ago
+QUANTILES = (0, 0.1, 0.25, 0.5, 0.9, 1)
+
+
+def _status_list(value):
+    return [status.strip() for status in value.split(',') if status.strip()]
+
+
+def load_export(rows, seed):
+    """The synthetic export parsed and compacted like an upload."""
+    df, _ = read_workbook(io.BytesIO(make_export(rows, seed)))
+    parse_dates(df)
+    compact_frame(df)
+    return df
+
+
+def answers(backend, settings):
+    """Every aggregate the dashboard and the API read, keyed by name."""
+    today = date.today()
+    start_of_year = date(today.year, 1, 1)
+    start = pd.Timestamp(today - timedelta(days=PERIOD_DAYS[0]))
+    end = pd.Timestamp(today - timedelta(days=PERIOD_DAYS[1]))
+    sketches = aggregates.aging_sketches(backend, settings)
+    result = {
+        'weekly_overview': aggregates.weekly_overview(backend, start, end, settings),
+        'period_metrics': aggregates.period_metrics(backend, start, end, settings),
+        'period_breakdowns': aggregates.period_breakdowns(backend, start, end, settings),
+        'weekly_cube': aggregates.weekly_cube(backend, settings),
+        'ytd_backlog': aggregates.ytd_backlog(backend, start_of_year, today, settings),
+        'average_age_trend': aggregates.average_age_trend(backend, start_of_year, today, settings),
+        'resolution_trend': aggregates.resolution_trend(backend, start_of_year, today, settings),
+        'aging_sketches': sketches,
+        'owner_age_percentiles': aggregates.owner_age_percentiles(sketches, settings.owners, start_of_year, today),
+    }
+    for product in aggregates.KEY_PRODUCT_LINES:
+        result[f'product_drilldown[{product}]'] = aggregates.product_drilldown(
+            backend, product, start_of_year, today, settings)
+        result[f'product_age_trend[{product}]'] = aggregates.product_age_trend(
+            backend, product, start_of_year, today, settings, sketches)
+    return result
+
+
+def assert_same(expected, actual, where):
+    """Recursively compares two aggregate results, frames by value and row order."""
+    if isinstance(expected, pd.DataFrame):
+        assert isinstance(actual, pd.DataFrame), where
+        # categoricals come back from SQL as plain strings
+        pd.testing.assert_frame_equal(expected.reset_index(drop=True), actual.reset_index(drop=True),
+                                      check_dtype=False, check_categorical=False, obj=where)
+    elif isinstance(expected, pd.Series):
+        pd.testing.assert_series_equal(expected, actual, check_dtype=False, check_categorical=False, obj=where)
+    elif isinstance(expected, DayHistogram):
+        assert (list(expected.days), list(expected.counts)) == (list(actual.days), list(actual.counts)), where
+    elif isinstance(expected, dict):
+        assert sorted(expected, key=repr) == sorted(actual, key=repr), f"{where}: keys differ"
+        for key, value in expected.items():
+            assert_same(value, actual[key], f"{where}[{key!r}]")
+    elif isinstance(expected, (list, tuple)):
+        assert len(expected) == len(actual), f"{where}: lengths differ"
+        for i, (value, other) in enumerate(zip(expected, actual)):
+            assert_same(value, other, f"{where}[{i}]")
+    elif isinstance(expected, float) and math.isnan(expected):
+        assert isinstance(actual, float) and math.isnan(actual), where
+    else:
+        assert expected == actual, f"{where}: {expected!r} != {actual!r}"
+
+
+def check_engines(df, engines, settings_list):
+    """Asserts every engine answers every aggregate like the first one."""
+    backends = {engine: open_backend(df, engine) for engine in engines}
+    reference, *others = engines
+    for settings in settings_list:
+        scope = f"product_line={settings.product_line}, owner={settings.owner}"
+        expected = answers(backends[reference], settings)
+        for engine in others:
+            actual = answers(backends[engine], settings)
+            for name, value in expected.items():
+                assert_same(value, actual[name], f"{engine} {name} ({scope})")
+        print(f"{scope}: {', '.join(others)} match {reference} on {len(expected)} aggregates")
+
+
+def check_histogram(seed):
+    """DayHistogram quantiles of merged and cut-off histograms equal numpy.quantile on the raw days."""
+    rng = np.random.default_rng(seed)
+    first, second = rng.integers(0, 400, 3000), rng.integers(200, 900, 50)
+    merged = DayHistogram(first) + DayHistogram(second).add([5, 5, 899])
+    raw = np.concatenate([first, second, [5, 5, 899]])
+    assert len(merged) == len(raw)
+    for upto in (None, 0, 5, 199, 450, 2000):
+        values = raw if upto is None else raw[raw <= upto]
+        assert merged.count_upto(upto if upto is not None else raw.max()) == len(values)
+        for q in QUANTILES:
+            expected = float(np.quantile(values, q)) if len(values) else float('nan')
+            assert_same(expected, merged.quantile(q, upto=upto), f"quantile({q}, upto={upto})")
+    assert math.isnan(DayHistogram().quantile(0.5))
+    print(f"DayHistogram quantiles match numpy on {len(raw)} values")
+
+
+def check_age_percentiles(df, settings):
+    """Median and p90 ages of merged product line/owner groups equal numpy.quantile on the raw ages."""
+    backend = open_backend(df, 'pandas')
+    sketches = aggregates.aging_sketches(backend, settings)
+    opened = df['Opened Date'].dt.normalize()
+    in_scope = (df['Status'].isin(settings.open_statuses_avg) & df['Case Owner'].isin(settings.owners)
+                & (df['Type'] != aggregates.EXCLUDED_TYPE))
+    today = pd.Timestamp(date.today())
+    # the first points precede every opening, so they also check that empty cut-offs are left out
+    points = pd.date_range(opened.min() - timedelta(days=14), today, freq='W-MON')
+    groups = [(None, None), (aggregates.KEY_PRODUCT_LINES, None), (None, settings.owners[:1]),
+              (PRODUCT_LINES[:2], settings.owners)]
+    for product_lines, owners in groups:
+        scope = in_scope.copy()
+        if product_lines is not None:
+            scope &= df['Product Line'].isin(product_lines)
+        if owners is not None:
+            scope &= df['Case Owner'].isin(owners)
+        rows = []
+        for point in points:
+            ages = (point - opened[scope & (opened <= point)]).dt.days.to_numpy()
+            if len(ages):
+                rows.append({WEEK_START: point, **{label: float(np.quantile(ages, q))
+                                                   for label, q in aggregates.AGE_PERCENTILES.items()}})
+        expected = pd.DataFrame(rows, columns=[WEEK_START, *aggregates.AGE_PERCENTILES])
+        actual = aggregates.age_percentiles(sketches, points, product_lines, owners)
+        assert_same(expected, actual, f"age_percentiles(product_lines={product_lines}, owners={owners})")
+    print(f"age_percentiles match numpy for {len(groups)} product line/owner groups")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that every backend engine computes the same aggregates.')
+    parser.add_argument('--rows', type=int, default=5000, help='rows in the synthetic export')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic export')
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=ENGINES,
+                        help='engines to compare, the first one being the reference')
+    args = parser.parse_args()
+
+    settings = aggregates.Settings(*(_status_list(DEFAULT_ENV[key]) for key in
+                                     ('OPEN_STATUSES', 'CLOSED_STATUSES', 'OPEN_STATUSES_AVG', 'SELECTED_OWNERS')))
+    settings_list = [settings, settings._replace(product_line=PRODUCT_LINES[1], owner=OWNERS[0])]
+    try:
+        df = load_export(args.rows, args.seed)
+        check_engines(df, args.engines, settings_list)
+        check_histogram(args.seed)
+        check_age_percentiles(df, settings)
+    except AssertionError as e:
+        sys.exit(f"Mismatch: {e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+"""
+Background ingestion of uploaded case exports.
+
+Parsing a large workbook blocks for a long time, and any widget touched
+meanwhile would restart the script and the parse with it. Instead each
+upload gets an `IngestJob` that reads, validates and indexes the data on a
+worker thread. Jobs live in a module-level registry keyed by the file's
+content hash, so reruns reattach to the running job instead of starting over,
+and the finished dataset is published in one step once everything is built.
+"""
+import io
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import openpyxl
+import pandas as pd
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from pandas.io.parsers import TextParser
+
+from backend import open_backend
+
+PROGRESS_EVERY = 2000
+MAX_DATASETS = 4
+# a text column becomes categorical when at most this share of its values are distinct
+CATEGORY_RATIO = 0.5
+
+# Columns the dashboard's own filters, breakdowns and charts read
+REQUIRED_COLUMNS = [
+    'Opened Date', 'Case Last Modified Date', 'Status', 'Case Owner',
+    'Product Line', 'Case Reason', 'Product Model', 'Type',
+]
+
+# The parsed frame is not kept: the pandas backend holds it, the SQL engines have their own copy
+Dataset = namedtuple('Dataset', ['dataset_id', 'backend', 'warning', 'memory_report', 'dropped_columns'])
+
+
+def _convert_cell(cell):
+    # mirrors pandas' openpyxl reader so the result equals pd.read_excel
+    if cell.value is None:
+        return ""
+    if cell.data_type == TYPE_ERROR:
+        return float('nan')
+    if cell.data_type == TYPE_NUMERIC:
+        as_int = int(cell.value)
+        return as_int if as_int == cell.value else float(cell.value)
+    return cell.value
+
+
+def read_workbook(source, on_rows=None, columns=None):
+    """Reads the first sheet of an .xlsx file into a DataFrame, row by row.
+
+    `on_rows(rows_read, total_rows)` is called every few thousand rows;
+    `total_rows` comes from the sheet dimensions and may be None. With
+    `columns` set, only header names in it are converted and kept; the
+    names of the skipped columns are returned alongside the frame.
+    """
+    book = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        sheet = book.worksheets[0]
+        total_rows = sheet.max_row
+        sheet.reset_dimensions()
+
+        data = []
+        last_row_with_data = -1
+        keep = None
+        dropped = []
+        for row_number, row in enumerate(sheet.rows):
+            if keep is None:
+                header = [_convert_cell(cell) for cell in row]
+                keep = [i for i, name in enumerate(header) if columns is None or name in columns]
+                dropped = [name for i, name in enumerate(header) if i not in keep and name != ""]
+            converted = [_convert_cell(row[i]) if i < len(row) else "" for i in keep]
+            while converted and converted[-1] == "":
+                converted.pop()
+            if converted:
+                last_row_with_data = row_number
+            data.append(converted)
+            if on_rows and row_number % PROGRESS_EVERY == 0:
+                on_rows(row_number, total_rows)
+    finally:
+        book.close()
+
+    data = data[:last_row_with_data + 1]
+    if not data:
+        return pd.DataFrame(), dropped
+    width = max(len(row) for row in data)
+    data = [row + [""] * (width - len(row)) for row in data]
+    if on_rows:
+        on_rows(len(data) - 1, len(data) - 1)
+    return TextParser(data, header=0).read(), dropped
+
+
+def select_columns(report_columns):
+    """Names to keep at ingest, or None to keep every column of the export."""
+    if report_columns is None:
+        return None
+    return set(REQUIRED_COLUMNS) | set(report_columns)
+
+
+def compact_frame(df):
+    """Interns repeated strings as categoricals and downcasts numerics in place.
+
+    Returns a per-column memory report comparing the parsed and stored sizes.
+    """
+    report = []
+    for column in df.columns:
+        series = df[column]
+        before = series.memory_usage(index=False, deep=True)
+        raw_dtype = str(series.dtype)
+        if pd.api.types.is_integer_dtype(series):
+            df[column] = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_float_dtype(series):
+            smaller = pd.to_numeric(series, downcast='float')
+            # only keep the narrower type when no value changes
+            if ((smaller.astype('float64') == series) | series.isna()).all():
+                df[column] = smaller
+        elif pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series):
+            values = series.dropna()
+            is_text = values.map(type).eq(str).all()
+            if is_text and values.nunique() <= len(values) * CATEGORY_RATIO:
+                df[column] = series.astype('category')
+        after = df[column].memory_usage(index=False, deep=True)
+        report.append({
+            'Column': column,
+            'Parsed As': raw_dtype,
+            'Stored As': str(df[column].dtype),
+            'Parsed (KB)': round(before / 1024, 1),
+            'Stored (KB)': round(after / 1024, 1),
+        })
+    return pd.DataFrame(report)
+
+
+def parse_dates(df):
+    """Converts the date columns in place; raises KeyError without 'Opened Date'."""
+    df['Opened Date'] = pd.to_datetime(df['Opened Date'], dayfirst=True)
+    if 'Case Last Modified Date' in df.columns:
+        df['Case Last Modified Date'] = pd.to_datetime(df['Case Last Modified Date'], dayfirst=True)
+    return df
+
+
+class IngestJob:
+    """Parses, validates and indexes one uploaded export on a worker thread."""
+
+    def __init__(self, data, dataset_id, engine='pandas', db_dir=None, report_columns=None):
+        self.dataset_id = dataset_id
+        self.engine = engine
+        self.db_dir = db_dir
+        self.columns = select_columns(report_columns)
+        self.result = None
+        self.error = None
+        self._data = data
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._stage = 'Queued'
+        self._rows_read = 0
+        self._total_rows = None
+        self._eta = None
+        self._thread = threading.Thread(target=self._run, name=f'ingest-{dataset_id}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    @property
+    def done(self):
+        return self.result is not None or self.error is not None
+
+    def progress(self):
+        """Snapshot of the job's state for the progress bar."""
+        with self._lock:
+            return {
+                'stage': self._stage,
+                'rows_read': self._rows_read,
+                'total_rows': self._total_rows,
+                'eta': self._eta,
+                'elapsed': time.monotonic() - self._started,
+            }
+
+    def _set_stage(self, stage):
+        with self._lock:
+            self._stage = stage
+            self._eta = None
+
+    def _on_rows(self, rows_read, total_rows):
+        elapsed = time.monotonic() - self._started
+        with self._lock:
+            self._rows_read = rows_read
+            self._total_rows = total_rows
+            if rows_read and total_rows and total_rows > rows_read:
+                self._eta = elapsed / rows_read * (total_rows - rows_read)
+            else:
+                self._eta = None
+
+    def _run(self):
+        try:
+            self._set_stage('Reading rows')
+            df, dropped_columns = read_workbook(io.BytesIO(self._data), self._on_rows, self.columns)
+            self._set_stage('Parsing dates')
+            try:
+                parse_dates(df)
+            except KeyError:
+                self._fail("Error: The uploaded file must contain an 'Opened Date' column.")
+                return
+            self._set_stage('Compacting columns')
+            memory_report = compact_frame(df)
+
+            self._set_stage(f'Indexing with {self.engine}')
+            warning = None
+            try:
+                backend = open_backend(df, self.engine, db_dir=self.db_dir, dataset_id=self.dataset_id)
+            except Exception as e:
+                warning = f"Could not start the '{self.engine}' backend ({e}). Falling back to pandas."
+                backend = open_backend(df, 'pandas')
+
+            # publish everything at once; readers only ever see a finished dataset
+            self.result = Dataset(self.dataset_id, backend, warning, memory_report, dropped_columns)
+            self._set_stage('Ready')
+        except Exception as e:
+            self._fail(f"Error processing Excel file: {e}")
+        finally:
+            self._data = None
+
+    def _fail(self, message):
+        self.error = message
+        self._set_stage('Failed')
+
+
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+
+
+def get_ingest_job(data, dataset_id, engine='pandas', db_dir=None, report_columns=None, current=None):
+    """Returns the job for this upload, starting it on first sight.
+
+    Shared by every session and rerun. `current` is the job the calling
+    session already holds; it is reattached instead of starting over when it
+    has left the registry. Only the most recent few finished datasets are
+    kept, and jobs still running are never evicted.
+    """
+    key = (dataset_id, engine)
+    with _jobs_lock:
+        job = _jobs.get(key)
+        if job is None:
+            if current is not None and (current.dataset_id, current.engine) == key:
+                job = _jobs[key] = current
+            else:
+                job = _jobs[key] = IngestJob(data, dataset_id, engine, db_dir, report_columns).start()
+        else:
+            _jobs.move_to_end(key)
+        _evict_finished()
+        return job
+
+
+def _evict_finished():
+    # oldest first; an evicted job lives on in the sessions still showing it
+    finished = [key for key, job in _jobs.items() if job.done]
+    for key in finished[:max(len(_jobs) - MAX_DATASETS, 0)]:
+        del _jobs[key]
+
+
+def only_dataset():
+    """The finished upload when exactly one is loaded, None when there is none.
+
+    Raises LookupError while several uploads are loaded, as a caller serving
+    "the" dataset can't tell which one is meant.
+    """
+    with _jobs_lock:
+        results = {job.result.dataset_id: job.result for job in _jobs.values() if job.result is not None}
+    if len(results) > 1:
+        raise LookupError(f"{len(results)} different uploads are loaded in the dashboard; "
+                          "the API only serves an upload while it is the only one")
+    return next(iter(results.values()), None)
@@ -0,0 +1,217 @@
+"""
+Headless load test for the dashboard.
+
+Drives N simulated sessions through the real app.py with Streamlit's testing
+API. Each session uploads a synthetic export, waits for the ingest, changes
+the date range and switches to week mode. Sessions run as threads of one
+process, as they do in a Streamlit server, so the shared ingest registry,
+caches and section thread pool are exercised too. Every session count runs
+in a fresh process, so one level's caches and memory don't carry into the
+next.
+
+    python load_test.py --sessions 1 2 4 8 --rows 20000
+    python load_test.py --sessions 4 --distinct-uploads --no-png
+
+For each session count it prints the latency percentiles of the reruns
+after the dashboard is up (opening the page, changing the range, switching
+to week mode), the time to get from upload to a rendered dashboard, the
+process CPU time and the peak RSS.
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(APP_DIR, 'app.py')
+INGEST_POLL_SECONDS = 0.5
+
+STATUSES = ['New', 'In Process', 'Waiting for customer response', 'Reopened',
+            'Closed - Complete', 'Closed - Duplicate']
+OWNERS = ['Akhila Kotha', 'Manasa Lakshmi', 'Surendra Moilla', 'Other Owner']
+PRODUCT_LINES = ['Barcode', 'RFID', 'PRI', 'Reach', 'Other']
+HISTORY_DAYS = 500
+
+# Used only when neither the environment nor a .env next to app.py sets them
+DEFAULT_ENV = {
+    'OPEN_STATUSES': 'New,In Process,Waiting for customer response,Reopened',
+    'CLOSED_STATUSES': 'Closed - Complete,Closed - Duplicate',
+    'OPEN_STATUSES_AVG': 'New,In Process,Waiting for customer response,Reopened',
+    'SELECTED_OWNERS': 'Akhila Kotha,Manasa Lakshmi',
+}
+
+
+def make_export(rows, seed=0):
+    """A synthetic case export as .xlsx bytes, opened over the last HISTORY_DAYS days."""
+    rng = np.random.default_rng(seed)
+    first_day = pd.Timestamp(date.today() - timedelta(days=HISTORY_DAYS))
+    opened = first_day + pd.to_timedelta(rng.integers(0, HISTORY_DAYS * 86400, rows), unit='s')
+    modified = opened + pd.to_timedelta(rng.integers(0, 60 * 86400, rows), unit='s')
+    df = pd.DataFrame({
+        'Case Number': np.arange(100000, 100000 + rows),
+        'Subject': [f'Synthetic case {i}' for i in range(rows)],
+        'Opened Date': opened.strftime('%d/%m/%Y %H:%M'),
+        'Case Last Modified Date': modified.strftime('%d/%m/%Y %H:%M'),
+        'Status': rng.choice(STATUSES, rows),
+        'Case Owner': rng.choice(OWNERS, rows),
+        'Product Line': rng.choice(PRODUCT_LINES, rows),
+        'Case Reason': rng.choice(['Install', 'Bug', 'Question', 'Hardware'], rows),
+        'Product Model': rng.choice(['M1', 'M2', 'M3'], rows),
+        'Type': rng.choice(['RMA request', 'Support', 'Other'], rows),
+    })
+    output = io.BytesIO()
+    df.to_excel(output, index=False)
+    return output.getvalue()
+
+
+def _is_ingesting(at):
+    return any(getattr(element, 'type', '') == 'progress' for element in at.main)
+
+
+def run_session(export, timeout, result):
+    """One user: upload, wait for the dashboard, pick a date range, switch to week mode."""
+    from streamlit.testing.v1 import AppTest
+
+    def timed(action, at):
+        started = time.perf_counter()
+        at.run()
+        result['reruns'].append((action, time.perf_counter() - started))
+        if at.exception:
+            raise RuntimeError(f"{action}: {at.exception[0].value}")
+
+    try:
+        at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        timed('open', at)
+
+        uploaded = time.perf_counter()
+        at.file_uploader[0].set_value(('export.xlsx', export, 'application/octet-stream'))
+        timed('upload', at)
+        while _is_ingesting(at):
+            time.sleep(INGEST_POLL_SECONDS)
+            timed('ingest poll', at)
+        result['ingest'] = time.perf_counter() - uploaded
+
+        today = date.today()
+        at.sidebar.date_input[0].set_value(today - timedelta(days=120))
+        at.sidebar.date_input[1].set_value(today - timedelta(days=30))
+        timed('date range', at)
+
+        at.sidebar.radio[0].set_value('By Week')
+        timed('week mode', at)
+    except Exception as e:
+        result['error'] = str(e)
+
+
+def _cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_level(sessions, rows, distinct_uploads, timeout, no_png):
+    """Runs `sessions` concurrent sessions in this process and returns their measurements."""
+    if no_png:
+        # isolates the dashboard's own cost from kaleido's image rendering
+        import plotly.basedatatypes
+        plotly.basedatatypes.BaseFigure.to_image = lambda self, *args, **kwargs: b''
+    if not os.path.exists(os.path.join(APP_DIR, '.env')):
+        for key, value in DEFAULT_ENV.items():
+            os.environ.setdefault(key, value)
+    # app.py reads print_button.html relative to the working directory
+    os.chdir(APP_DIR)
+
+    exports = [make_export(rows, seed if distinct_uploads else 0) for seed in range(sessions)]
+    results = [{'reruns': [], 'ingest': None, 'error': None} for _ in range(sessions)]
+    threads = [threading.Thread(target=run_session, args=(exports[i], timeout, results[i]), name=f'session-{i}')
+               for i in range(sessions)]
+
+    cpu_before = _cpu_seconds()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    cpu = _cpu_seconds() - cpu_before
+
+    # the upload rerun follows the progress bar's own reruns until the ingest is done, so it and
+    # any polls after it measure the ingest, which is reported as ingest_s instead
+    latencies = [seconds for result in results for action, seconds in result['reruns']
+                 if action not in ('upload', 'ingest poll')]
+    ingest = [result['ingest'] for result in results if result['ingest'] is not None]
+    return {
+        'sessions': sessions,
+        'reruns': len(latencies),
+        'p50_ms': float(np.percentile(latencies, 50) * 1000) if latencies else None,
+        'p90_ms': float(np.percentile(latencies, 90) * 1000) if latencies else None,
+        'p99_ms': float(np.percentile(latencies, 99) * 1000) if latencies else None,
+        'max_ms': max(latencies) * 1000 if latencies else None,
+        'ingest_s': max(ingest) if ingest else None,
+        'wall_s': wall,
+        'cpu_s': cpu,
+        'cpu_s_per_session': cpu / sessions,
+        'peak_rss_mb': _peak_rss_mb(),
+        'errors': [result['error'] for result in results if result['error']],
+    }
+
+
+def _format(value, digits=0):
+    return '-' if value is None else f'{value:.{digits}f}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the case dashboard with simulated sessions.')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='concurrent session counts to measure, one fresh process each')
+    parser.add_argument('--rows', type=int, default=20000, help='rows in the synthetic export')
+    parser.add_argument('--distinct-uploads', action='store_true',
+                        help='give every session its own export instead of sharing one')
+    parser.add_argument('--no-png', action='store_true', help='skip kaleido PNG rendering of the charts')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds a single rerun may take')
+    parser.add_argument('--json', action='store_true', help='print the measurements as JSON lines')
+    parser.add_argument('--level', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.level:
+        print(json.dumps(run_level(args.level, args.rows, args.distinct_uploads, args.timeout, args.no_png)))
+        return
+
+    if not args.json:
+        print(f"{'sessions':>8} {'reruns':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+              f"{'ingest s':>8} {'CPU s':>7} {'CPU s/sess':>10} {'peak RSS MB':>11}")
+    for sessions in args.sessions:
+        command = [sys.executable, os.path.abspath(__file__), '--level', str(sessions), '--rows', str(args.rows),
+                   '--timeout', str(args.timeout)]
+        command += ['--distinct-uploads'] * args.distinct_uploads + ['--no-png'] * args.no_png
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"{sessions:>8} failed:\n{completed.stderr}", file=sys.stderr)
+            continue
+        level = json.loads(completed.stdout.strip().splitlines()[-1])
+        if args.json:
+            print(json.dumps(level))
+        else:
+            print(f"{sessions:>8} {level['reruns']:>6} {_format(level['p50_ms']):>8} {_format(level['p90_ms']):>8} "
+                  f"{_format(level['p99_ms']):>8} {_format(level['max_ms']):>8} {_format(level['ingest_s'], 1):>8} "
+                  f"{_format(level['cpu_s'], 1):>7} {_format(level['cpu_s_per_session'], 1):>10} "
+                  f"{_format(level['peak_rss_mb']):>11}")
+        for error in level['errors']:
+            print(f"  session error: {error}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
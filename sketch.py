@@ -0,0 +1,56 @@
+"""
+Mergeable day histograms for streaming age percentiles.
+
+A `DayHistogram` counts integer day values. Two histograms merge by adding
+their counts, so a sketch built once per product line and owner can be
+combined for any selection of them, and cases from a new export can be
+folded in without revisiting the old ones. Cases are only ever aged in
+whole days, so bucketing by day loses nothing: quantiles match
+`numpy.quantile` (linear interpolation) on the raw values exactly, and the
+size is bounded by the number of distinct days rather than of cases.
+"""
+import numpy as np
+
+
+class DayHistogram:
+    """Counts of integer day values, kept sorted by day."""
+
+    def __init__(self, days=(), counts=None):
+        days = np.asarray(days, dtype='int64')
+        counts = np.ones(len(days), dtype='int64') if counts is None else np.asarray(counts, dtype='int64')
+        self.days, inverse = np.unique(days, return_inverse=True)
+        self.counts = np.bincount(inverse, weights=counts, minlength=len(self.days)).astype('int64')
+        self._cumulative = np.cumsum(self.counts)
+
+    def __len__(self):
+        return int(self._cumulative[-1]) if len(self._cumulative) else 0
+
+    def merge(self, other):
+        """A new histogram counting the values of both."""
+        return DayHistogram(np.concatenate([self.days, other.days]), np.concatenate([self.counts, other.counts]))
+
+    __add__ = merge
+
+    def add(self, days):
+        """A new histogram with `days` counted as well."""
+        return self.merge(DayHistogram(days))
+
+    def count_upto(self, day):
+        """Number of values at or below `day`."""
+        index = np.searchsorted(self.days, day, side='right')
+        return int(self._cumulative[index - 1]) if index else 0
+
+    def quantile(self, q, upto=None):
+        """The q-quantile of the values at or below `upto` (of all values by default).
+
+        Returns NaN when there are no such values.
+        """
+        n = len(self) if upto is None else self.count_upto(upto)
+        if n == 0:
+            return float('nan')
+        position = (n - 1) * q
+        lower = int(np.floor(position))
+        upper = min(lower + 1, n - 1)
+        # the value of 0-based rank r sits in the first bucket whose running count exceeds r
+        low_value, high_value = self.days[np.searchsorted(self._cumulative, [lower, upper], side='right')]
+        return float(low_value + (high_value - low_value) * (position - lower))
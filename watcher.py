@@ -0,0 +1,218 @@
+"""
+Watch-folder ingestion of scheduled CRM exports.
+
+A `FolderWatcher` polls a local directory for .xlsx exports. A file is
+picked up once its size and modification time have stopped changing and
+re-read only when its content hash differs from the last time, so an hourly
+drop costs one parse of the new file rather than of the whole folder. All
+parsed exports are combined into one dataset, newest export winning for a
+case that appears in several, and published in a single step for every
+open session to pick up.
+
+Between scans the combined cases live only in the published dataset's
+backend, so memory grows with the number of distinct cases rather than
+with the number of exports. The
+older copies of a case are gone once a newer export has it, which means
+deleting that newer export removes the case rather than restoring them.
+"""
+import glob
+import hashlib
+import os
+import threading
+import time
+
+import pandas as pd
+
+from backend import CaseFilter, open_backend
+from ingest import Dataset, compact_frame, parse_dates, read_workbook, select_columns
+
+CASE_ID_COLUMN = 'Case Number'
+# export each combined row came from; kept beside the frame, not in it
+SOURCE_COLUMN = '__source'
+HASH_CHUNK = 1 << 20
+# a file untouched for this long is taken as fully written even on first sighting
+SETTLE_SECONDS = 5
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def combine_exports(frames):
+    """Stacks per-file frames oldest first, keeping the newest row of each case."""
+    combined = pd.concat(frames, ignore_index=True)
+    if CASE_ID_COLUMN in combined.columns:
+        combined = combined.drop_duplicates(subset=CASE_ID_COLUMN, keep='last', ignore_index=True)
+    return combined
+
+
+class FolderWatcher:
+    """Keeps `dataset` in sync with the exports found in `directory`."""
+
+    def __init__(self, directory, engine='pandas', db_dir=None, report_columns=None, interval=30):
+        self.directory = directory
+        self.engine = engine
+        self.db_dir = db_dir
+        self.columns = select_columns(report_columns)
+        if self.columns is not None:
+            # exports can only be merged case by case
+            self.columns |= {CASE_ID_COLUMN}
+        self.interval = interval
+        self.dataset = None
+        self.version = 0
+        self.updated_at = None
+        self.errors = {}
+        self._status = 'Waiting for the first scan'
+        self._seen = {}      # path -> (size, mtime) from the previous scan
+        self._files = {}     # path -> (size, mtime, content hash) of the exports in the dataset
+        self._failed = {}    # path -> (size, mtime) of exports that could not be read
+        self._dropped = {}   # path -> columns skipped when reading it
+        self._sources = None  # export each row of the published dataset came from
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='folder-watcher', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def status(self):
+        with self._lock:
+            return self._status
+
+    @property
+    def error_messages(self):
+        with self._lock:
+            return list(self.errors.values())
+
+    def _set_status(self, status):
+        with self._lock:
+            self._status = status
+
+    def _set_error(self, path, error=None):
+        with self._lock:
+            if error is None:
+                self.errors.pop(path, None)
+            else:
+                self.errors[path] = error
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.scan()
+            except Exception as e:
+                self._set_status(f"Scan failed: {e}")
+            self._stop.wait(self.interval)
+
+    def _export_paths(self):
+        paths = glob.glob(os.path.join(self.directory, '*.xlsx'))
+        # skip the lock files Excel leaves next to open workbooks
+        return [p for p in paths if not os.path.basename(p).startswith('~$')]
+
+    def scan(self):
+        """Re-reads new or changed exports and republishes the dataset if anything changed."""
+        current = {}
+        for path in self._export_paths():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            current[path] = (stat.st_size, stat.st_mtime)
+
+        removed = set(self._files) - set(current)
+        for path in removed:
+            del self._files[path]
+            self._dropped.pop(path, None)
+        for path in set(self._failed) - set(current):
+            del self._failed[path]
+            self._set_error(path)
+
+        fresh = {}
+        for path, signature in current.items():
+            cached = self._files.get(path)
+            if cached and cached[:2] == signature or self._failed.get(path) == signature:
+                continue
+            settled = self._seen.get(path) == signature or time.time() - signature[1] > SETTLE_SECONDS
+            if not settled:
+                # may still be being written; look again next scan
+                continue
+            content_hash = file_hash(path)
+            if cached and cached[2] == content_hash:
+                self._files[path] = signature + (content_hash,)
+                continue
+            self._set_status(f"Reading {os.path.basename(path)}")
+            try:
+                frame, dropped = read_workbook(path, columns=self.columns)
+                parse_dates(frame)
+            except Exception as e:
+                # not retried until the file changes again
+                self._failed[path] = signature
+                self._set_error(path, f"Error processing Excel file: {e}")
+                continue
+            self._failed.pop(path, None)
+            self._set_error(path)
+            self._files[path] = signature + (content_hash,)
+            self._dropped[path] = dropped
+            fresh[path] = frame
+
+        self._seen = current
+        if removed or fresh:
+            self._publish(removed | set(fresh), fresh)
+        elif self.dataset is not None:
+            self._set_status('Up to date')
+        elif not current:
+            self._set_status('No exports found yet')
+
+    def _published_rows(self):
+        backend = self.dataset.backend
+        if backend.engine == 'pandas':
+            return backend.df
+        # the SQL engines hold the only copy of the rows; read them back rather than keep another
+        return backend.rows(CaseFilter()).reset_index(drop=True)
+
+    def _publish(self, replaced, fresh):
+        """Swaps the rows of the `replaced` exports for the `fresh` frames read from them."""
+        if not self._files:
+            self._sources = None
+            self.dataset = None
+            self.version += 1
+            self._set_status('No exports found yet')
+            return
+        self._set_status('Combining exports')
+        parts = {path: frame.assign(**{SOURCE_COLUMN: path}) for path, frame in fresh.items()}
+        if self.dataset is not None:
+            kept = self._published_rows().assign(**{SOURCE_COLUMN: self._sources})
+            kept = kept[~kept[SOURCE_COLUMN].isin(replaced)]
+            parts.update((path, rows) for path, rows in kept.groupby(SOURCE_COLUMN, observed=True, sort=False))
+        ordered = sorted(self._files.items(), key=lambda item: item[1][1])
+        df = combine_exports([parts[path] for path, _ in ordered if path in parts])
+        sources = df.pop(SOURCE_COLUMN).astype('category')
+        memory_report = compact_frame(df)
+        dataset_id = hashlib.sha256(
+            ''.join(entry[2] for _, entry in ordered).encode()).hexdigest()[:16]
+
+        self._set_status(f'Indexing with {self.engine}')
+        warnings = []
+        if CASE_ID_COLUMN not in df.columns:
+            warnings.append(f"The exports have no '{CASE_ID_COLUMN}' column, so a case found in several "
+                            "of them is counted once per export.")
+        try:
+            backend = open_backend(df, self.engine, db_dir=self.db_dir, dataset_id=dataset_id)
+        except Exception as e:
+            warnings.append(f"Could not start the '{self.engine}' backend ({e}). Falling back to pandas.")
+            backend = open_backend(df, 'pandas')
+
+        dropped = sorted({str(c) for columns in self._dropped.values() for c in columns})
+        self._sources = sources
+        self.dataset = Dataset(dataset_id, backend, ' '.join(warnings) or None, memory_report, dropped)
+        self.updated_at = time.time()
+        self.version += 1
+        self._set_status('Up to date')